@@ -0,0 +1,318 @@
+"""
+字体和背景文件的目录：记录字体名称、支持的字符范围以及背景图片的尺寸和颜色模式，保存在磁盘上。
+启动和打开设置窗口时只检查文件的修改时间和大小，只有新增或修改过的文件才会重新读取
+"""
+from PIL import Image, ImageFont
+from bisect import bisect_right
+import hashlib
+import json
+import os
+import struct
+import threading
+
+CATALOG_DIR = os.path.join('cache', 'asset_catalog')
+
+# 文件格式改变时增加版本号，旧的目录自动重建
+CATALOG_VERSION = 3
+
+FONT_EXTENSIONS = ('.ttf', '.ttc', '.otf')
+BACKGROUND_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def open_font_tables(f, index=0):
+    """读取字体文件的表目录，返回(读取函数, {表名: 偏移})"""
+    def read(offset, size):
+        f.seek(offset)
+        data = f.read(size)
+        if len(data) != size:
+            raise ValueError("字体文件不完整")
+        return data
+
+    face_offset = 0
+    if read(0, 4) == b'ttcf':
+        face_count = struct.unpack('>I', read(8, 4))[0]
+        if index >= face_count:
+            raise ValueError("字体集合中没有该字体")
+        face_offset = struct.unpack('>I', read(12 + index * 4, 4))[0]
+
+    table_count = struct.unpack('>H', read(face_offset + 4, 2))[0]
+    directory = read(face_offset + 12, table_count * 16)
+    tables = {}
+    for i in range(table_count):
+        tag, _, offset, _ = struct.unpack('>4sIII', directory[i * 16:i * 16 + 16])
+        tables[tag.decode('latin-1')] = offset
+    return read, tables
+
+
+def read_cmap_ranges(path, index=0):
+    """读取字体cmap表中有字形的字符，返回合并后的范围[[起始, 结束], ...]（含结束）"""
+    with open(path, 'rb') as f:
+        read, tables = open_font_tables(f, index)
+        cmap_offset = tables.get('cmap')
+        if cmap_offset is None:
+            return []
+
+        # 优先使用完整Unicode的子表，其次是基本多文种平面的子表
+        subtable_count = struct.unpack('>H', read(cmap_offset + 2, 2))[0]
+        records = read(cmap_offset + 4, subtable_count * 8)
+        subtables = {}
+        for i in range(subtable_count):
+            platform_id, encoding_id, offset = struct.unpack('>HHI', records[i * 8:i * 8 + 8])
+            subtables.setdefault((platform_id, encoding_id), cmap_offset + offset)
+        # 有些字体把字符映射到没有轮廓的空字形，这些字符也当作缺字
+        empty = read_empty_glyphs(read, tables)
+        for key in ((3, 10), (0, 6), (0, 4), (3, 1), (0, 3), (0, 2), (0, 1), (0, 0), (3, 0)):
+            if key in subtables:
+                offset = subtables[key]
+                subtable_format = struct.unpack('>H', read(offset, 2))[0]
+                if subtable_format == 12:
+                    return read_format12(read, offset, empty)
+                if subtable_format == 4:
+                    return read_format4(read, offset, empty)
+        return []
+
+
+def read_empty_glyphs(read, tables):
+    """TrueType字体中没有轮廓的字形编号，不是TrueType轮廓（如CFF）时返回空集合"""
+    if not all(tag in tables for tag in ('head', 'maxp', 'loca', 'glyf')):
+        return set()
+    loca_format = struct.unpack('>h', read(tables['head'] + 50, 2))[0]
+    glyph_count = struct.unpack('>H', read(tables['maxp'] + 4, 2))[0]
+    if loca_format == 0:
+        offsets = struct.unpack(f'>{glyph_count + 1}H', read(tables['loca'], (glyph_count + 1) * 2))
+    else:
+        offsets = struct.unpack(f'>{glyph_count + 1}I', read(tables['loca'], (glyph_count + 1) * 4))
+    # 相邻两项相等表示字形数据长度为0
+    return {glyph for glyph in range(glyph_count) if offsets[glyph] == offsets[glyph + 1]}
+
+
+def has_glyph(code, glyph, empty):
+    # 空白字符本来就没有轮廓
+    return glyph != 0 and (glyph not in empty or chr(code).isspace())
+
+
+def read_font_names(path, index=0):
+    """从name表读取(字体名称, 样式)，优先使用中文名称，没有name表时返回None"""
+    with open(path, 'rb') as f:
+        read, tables = open_font_tables(f, index)
+        name_offset = tables.get('name')
+        if name_offset is None:
+            return None
+        count, string_offset = struct.unpack('>HH', read(name_offset + 2, 4))
+        records = read(name_offset + 6, count * 12)
+        # (平台, 语言)的优先顺序：Windows简体中文、繁体中文、英文，最后是Mac英文
+        priority = {(3, 0x0804): 0, (3, 0x0404): 1, (3, 0x0C04): 2, (3, 0x0409): 3, (1, 0): 4}
+        names = {}
+        for i in range(count):
+            platform_id, encoding_id, language_id, name_id, length, offset = \
+                struct.unpack('>HHHHHH', records[i * 12:i * 12 + 12])
+            rank = priority.get((platform_id, language_id), 5)
+            if name_id not in (1, 2) or (name_id in names and names[name_id][0] <= rank):
+                continue
+            data = read(name_offset + string_offset + offset, length)
+            if platform_id == 3 or platform_id == 0:
+                value = data.decode('utf-16-be', errors='replace')
+            elif encoding_id == 0:
+                value = data.decode('mac-roman', errors='replace')
+            else:
+                continue
+            names[name_id] = (rank, value.strip('\x00 '))
+        if 1 not in names:
+            return None
+        return names[1][1], names[2][1] if 2 in names else 'Regular'
+
+
+def read_format4(read, offset, empty=frozenset()):
+    length = struct.unpack('>H', read(offset + 2, 2))[0]
+    data = read(offset, length)
+    seg_count = struct.unpack('>H', data[6:8])[0] // 2
+    ends = struct.unpack(f'>{seg_count}H', data[14:14 + seg_count * 2])
+    starts_at = 16 + seg_count * 2
+    starts = struct.unpack(f'>{seg_count}H', data[starts_at:starts_at + seg_count * 2])
+    deltas = struct.unpack(f'>{seg_count}h', data[starts_at + seg_count * 2:starts_at + seg_count * 4])
+    range_offsets_at = starts_at + seg_count * 4
+    range_offsets = struct.unpack(f'>{seg_count}H', data[range_offsets_at:range_offsets_at + seg_count * 2])
+    codes = []
+    for i in range(seg_count):
+        start, end = starts[i], ends[i]
+        if start == 0xFFFF:
+            continue
+        if range_offsets[i] == 0:
+            codes.extend(code for code in range(start, end + 1) if has_glyph(code, (code + deltas[i]) & 0xFFFF, empty))
+            continue
+        for code in range(start, end + 1):
+            glyph_at = range_offsets_at + i * 2 + range_offsets[i] + (code - start) * 2
+            if glyph_at + 2 > len(data):
+                continue
+            glyph = struct.unpack('>H', data[glyph_at:glyph_at + 2])[0]
+            if glyph and has_glyph(code, (glyph + deltas[i]) & 0xFFFF, empty):
+                codes.append(code)
+    return merge_ranges((code, code) for code in codes)
+
+
+def read_format12(read, offset, empty=frozenset()):
+    group_count = struct.unpack('>I', read(offset + 12, 4))[0]
+    data = read(offset + 16, group_count * 12)
+    groups = []
+    for i in range(group_count):
+        start, end, glyph = struct.unpack('>III', data[i * 12:i * 12 + 12])
+        if empty or glyph == 0:
+            # 逐个检查，去掉映射到空字形的字符
+            groups.extend((code, code) for code in range(start, end + 1)
+                          if has_glyph(code, glyph + code - start, empty))
+        elif start <= end:
+            groups.append((start, end))
+    return merge_ranges(groups)
+
+
+def merge_ranges(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def read_font_info(path):
+    """读取字体的名称和支持的字符范围"""
+    names = read_font_names(path)
+    if names is None:
+        names = ImageFont.truetype(path, 16).getname()
+    family, style = names
+    coverage = read_cmap_ranges(path)
+    return {
+        'family': family,
+        'style': style,
+        'char_count': sum(end - start + 1 for start, end in coverage),
+        'coverage': coverage
+    }
+
+
+def read_background_info(path):
+    """只读取图片的文件头"""
+    with Image.open(path) as img:
+        return {'width': img.width, 'height': img.height, 'mode': img.mode, 'format': img.format}
+
+
+def catalog_path(kind, directory, cache_dir=CATALOG_DIR):
+    """每个素材文件夹单独保存一个目录文件，不同文件夹中的同名文件不会互相覆盖"""
+    digest = hashlib.sha1(os.path.abspath(directory).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, f'{kind}_{digest}.json')
+
+
+class AssetCatalog:
+    """
+    fonts/和background/中文件的目录，保存在磁盘上，按修改时间和大小判断文件是否改变。
+    background_dir为None时只记录字体，不读取背景文件夹
+    """
+
+    def __init__(self, fonts_dir='fonts', background_dir='background', cache_dir=CATALOG_DIR):
+        self.fonts_dir = fonts_dir
+        self.background_dir = background_dir
+        self.directories = {'fonts': fonts_dir}
+        if background_dir is not None:
+            self.directories['backgrounds'] = background_dir
+        self.paths = {kind: catalog_path(kind, directory, cache_dir) for kind, directory in self.directories.items()}
+        self.entries = {'fonts': {}, 'backgrounds': {}}
+        self._coverage_starts = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        for kind, path in self.paths.items():
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == CATALOG_VERSION and \
+                        data.get('directory') == os.path.abspath(self.directories[kind]):
+                    self.entries[kind] = data.get('entries', {})
+            except Exception as e:
+                print(f"读取素材目录失败: {str(e)}")
+
+    def save(self, kind):
+        path = self.paths[kind]
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        data = {
+            'version': CATALOG_VERSION,
+            'directory': os.path.abspath(self.directories[kind]),
+            'entries': self.entries[kind]
+        }
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"保存素材目录失败: {str(e)}")
+
+    def refresh(self):
+        """检查素材文件夹，重新读取新增或修改过的文件，返回目录是否有变化"""
+        kinds = (('fonts', FONT_EXTENSIONS, read_font_info),
+                 ('backgrounds', BACKGROUND_EXTENSIONS, read_background_info))
+        changed = False
+        with self._lock:
+            for kind, extensions, read_info in kinds:
+                if kind in self.directories and \
+                        self.refresh_kind(kind, self.directories[kind], extensions, read_info):
+                    self.save(kind)
+                    changed = True
+            if changed:
+                self._coverage_starts.clear()
+        return changed
+
+    def refresh_kind(self, kind, directory, extensions, read_info):
+        old_entries = self.entries[kind]
+        entries = {}
+        changed = False
+        if os.path.isdir(directory):
+            with os.scandir(directory) as scan:
+                for item in scan:
+                    if not item.name.lower().endswith(extensions) or not item.is_file():
+                        continue
+                    stat = item.stat()
+                    entry = old_entries.get(item.name)
+                    if entry is None or entry['mtime'] != stat.st_mtime or entry['size'] != stat.st_size:
+                        try:
+                            entry = dict(read_info(item.path), mtime=stat.st_mtime, size=stat.st_size)
+                        except Exception as e:
+                            print(f"读取素材失败 {item.path}: {str(e)}")
+                            entry = {'mtime': stat.st_mtime, 'size': stat.st_size, 'error': str(e)}
+                        changed = True
+                    entries[item.name] = entry
+        changed = changed or entries.keys() != old_entries.keys()
+        self.entries[kind] = entries
+        return changed
+
+    def font_names(self):
+        """可用的字体文件名，按名称排序"""
+        return sorted(name for name, entry in self.entries['fonts'].items() if 'error' not in entry)
+
+    def background_names(self):
+        return sorted(name for name, entry in self.entries['backgrounds'].items() if 'error' not in entry)
+
+    def get_font_info(self, name):
+        return self.entries['fonts'].get(name)
+
+    def get_background_info(self, name):
+        return self.entries['backgrounds'].get(name)
+
+    def clear_cache(self):
+        """清空has_char()按需生成的索引"""
+        self._coverage_starts.clear()
+
+    def has_char(self, name, char):
+        """字体是否包含该字符的字形"""
+        entry = self.entries['fonts'].get(name)
+        if not entry or 'coverage' not in entry:
+            return False
+        starts = self._coverage_starts.get(name)
+        if starts is None:
+            starts = self._coverage_starts[name] = [start for start, _ in entry['coverage']]
+        index = bisect_right(starts, ord(char)) - 1
+        return index >= 0 and ord(char) <= entry['coverage'][index][1]
@@ -0,0 +1,182 @@
+"""
+设置窗口中字体和背景的缩略图：背景图片的小图和每种字体写出的一行示例文字。
+在后台线程中按需生成并保存在磁盘上，浏览素材时不需要整页渲染
+"""
+from PIL import Image, ImageDraw, ImageFont
+from render_cache import LRUCache
+import hashlib
+import itertools
+import json
+import os
+import queue
+import threading
+
+THUMBNAIL_DIR = os.path.join('cache', 'thumbnails')
+
+# 生成方式改变时增加版本号，旧的缩略图不再使用
+THUMBNAIL_VERSION = 1
+
+SAMPLE_TEXT = "永和九年，岁在癸丑 ABC 123"
+
+# 队列中的优先级，数字小的先生成：用户正在查看的素材优先于预先生成的素材
+PRIORITY_REQUEST = 0
+PRIORITY_PREFETCH = 1
+
+
+def make_background_thumbnail(path, size):
+    """背景图片缩小到size以内，JPEG在解码时直接缩小"""
+    with Image.open(path) as img:
+        img.draft('RGB', size)
+        img = img.convert('RGB')
+        img.thumbnail(size, Image.Resampling.LANCZOS)
+        return img
+
+
+def make_font_sample(path, font_size, text=SAMPLE_TEXT, max_width=320):
+    """用字体写一行示例文字，超过max_width时截断"""
+    font = ImageFont.truetype(path, font_size)
+    left, top, right, bottom = font.getbbox(text)
+    padding = font_size // 4
+    width = min(max_width, right - left + padding * 2)
+    height = bottom - top + padding * 2
+    img = Image.new('RGB', (width, height), 'white')
+    ImageDraw.Draw(img).text((padding - left, padding - top), text, font=font, fill='black')
+    return img
+
+
+class ThumbnailCache:
+    """
+    缩略图缓存：内存中保留最近使用的缩略图，磁盘上按文件的修改时间和大小保存。
+    没有缓存时在后台线程中按优先级生成，完成后通过poll()交给界面线程
+    """
+
+    def __init__(self, cache_dir=THUMBNAIL_DIR, background_size=(240, 240), font_size=28, max_entries=256):
+        self.cache_dir = cache_dir
+        self.background_size = background_size
+        self.font_size = font_size
+        self.images = LRUCache(max_entries)
+        self.messages = queue.Queue()
+        # 等待生成的缩略图 -> 当前优先级，避免重复提交
+        self.pending = {}
+        self._lock = threading.Lock()
+        # (优先级, 序号, 类型, 路径, 缓存键)，同一优先级中用户请求的后请求的先生成，预先生成的按顺序生成
+        self.tasks = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self.closed = False
+        # 只用一个线程，生成缩略图不影响界面和渲染
+        self._thread = threading.Thread(target=self.run, name='thumbnail', daemon=True)
+        self._thread.start()
+
+    def get_key(self, kind, path):
+        """文件修改后缩略图自动失效"""
+        stat = os.stat(path)
+        params = self.background_size if kind == 'background' else self.font_size
+        data = json.dumps([THUMBNAIL_VERSION, kind, os.path.abspath(path), stat.st_mtime_ns, stat.st_size, params])
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def get_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.png')
+
+    def get(self, kind, path):
+        """返回缩略图，kind为'font'或'background'；还没有生成时在后台生成并返回None"""
+        try:
+            key = self.get_key(kind, path)
+        except OSError:
+            return None
+        img = self.images.get(key)
+        if img is not None:
+            return img
+        thumb_path = self.get_path(key)
+        if os.path.exists(thumb_path):
+            try:
+                with Image.open(thumb_path) as cached:
+                    img = cached.convert('RGB')
+                self.images.put(key, img)
+                return img
+            except Exception as e:
+                print(f"读取缩略图失败: {str(e)}")
+        self.request(kind, path, key)
+        return None
+
+    def request(self, kind, path, key=None, priority=PRIORITY_REQUEST):
+        """
+        在后台生成缩略图。已经在队列中的不再重复提交，
+        但用户请求的素材会提到预先生成的素材前面
+        """
+        sequence = next(self._sequence)
+        with self._lock:
+            if self.closed:
+                return
+            current = self.pending.get((kind, path))
+            if current is not None and current <= priority:
+                return
+            self.pending[(kind, path)] = priority
+        # 用户请求的素材后请求的先生成
+        self.tasks.put((priority, -sequence if priority == PRIORITY_REQUEST else sequence, kind, path, key))
+
+    def prefetch(self, kind, paths):
+        """提前生成一批素材（如下拉列表中可以看到的几项）的缩略图，已有的跳过"""
+        for path in paths:
+            try:
+                key = self.get_key(kind, path)
+            except OSError:
+                continue
+            if self.images.get(key) is None and not os.path.exists(self.get_path(key)):
+                self.request(kind, path, key, PRIORITY_PREFETCH)
+
+    def run(self):
+        """后台线程：按优先级依次生成缩略图"""
+        while True:
+            priority, _, kind, path, key = self.tasks.get()
+            if kind is None:
+                return
+            with self._lock:
+                # 提高优先级后重新放入队列的素材，原来的那一项跳过
+                if self.pending.get((kind, path)) != priority:
+                    continue
+            self.generate(kind, path, key)
+
+    def generate(self, kind, path, key=None):
+        try:
+            key = key or self.get_key(kind, path)
+            if kind == 'background':
+                img = make_background_thumbnail(path, self.background_size)
+            else:
+                img = make_font_sample(path, self.font_size)
+            self.save(key, img)
+            self.images.put(key, img)
+            self.messages.put((kind, path, img))
+        except Exception as e:
+            print(f"生成缩略图失败 {path}: {str(e)}")
+        finally:
+            with self._lock:
+                self.pending.pop((kind, path), None)
+
+    def save(self, key, img):
+        """先写临时文件再改名"""
+        thumb_path = self.get_path(key)
+        directory = os.path.dirname(thumb_path)
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        temp_path = f'{thumb_path}.{os.getpid()}.tmp'
+        try:
+            img.save(temp_path, 'PNG')
+            os.replace(temp_path, thumb_path)
+        except OSError as e:
+            print(f"保存缩略图失败: {str(e)}")
+
+    def poll(self):
+        """取出目前为止生成完成的缩略图[(类型, 路径, 图片), ...]，应在界面线程中定时调用"""
+        results = []
+        while True:
+            try:
+                results.append(self.messages.get_nowait())
+            except queue.Empty:
+                return results
+
+    def shutdown(self):
+        """停止后台线程，队列中还没有生成的缩略图不再生成"""
+        with self._lock:
+            self.closed = True
+            self.pending.clear()
+        self.tasks.put((-1, 0, None, None, None))
@@ -0,0 +1,179 @@
+"""
+asyncio接口：排版、渲染和编码在线程池中执行，不阻塞事件循环，
+同时进行的排版和渲染步骤数量由信号量限制，支持取消和超时
+
+用法：
+    async with AsyncRenderer(load_settings(), max_concurrency=2) as renderer:
+        filenames = await renderer.convert(text, 'Output/essay', timeout=30)
+        async for img in renderer.iter_pages(text, {'seed': 1}):
+            ...
+"""
+from handwriting_renderer import HandwritingRenderer, merge_settings
+from output_encoders import get_encoder
+from render_worker import RenderJob
+from asset_catalog import AssetCatalog
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import itertools
+import os
+import threading
+
+
+class AsyncRenderer:
+    """
+    供asyncio程序使用的渲染器。每个任务从开始到结束使用同一个HandwritingRenderer，
+    排版和各页的渲染可能在不同线程中执行，但不会用到其他任务的设置；缓存在所有渲染器之间共享
+    """
+
+    def __init__(self, settings, fonts_dir='fonts', max_concurrency=2, io_workers=2):
+        self.settings = settings
+        self.fonts_dir = fonts_dir
+        # 所有渲染器共用一份字体目录
+        # 渲染只需要字体的信息，不读取背景文件夹
+        self.asset_catalog = AssetCatalog(fonts_dir, None)
+        self.asset_catalog.refresh()
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='async-render')
+        # 写文件使用单独的线程，渲染下一页时同时写入上一页
+        self.io_executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix='async-io')
+        # 空闲的渲染器，任务结束后放回，供下一个任务使用
+        self._renderers = []
+        self._lock = threading.Lock()
+        self._job_ids = itertools.count(1)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        """等待正在执行的任务结束后关闭线程池"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.executor.shutdown)
+        await loop.run_in_executor(None, self.io_executor.shutdown)
+
+    def acquire_renderer(self):
+        """取得一个任务专用的渲染器，任务结束前不会交给其他任务"""
+        with self._lock:
+            if self._renderers:
+                return self._renderers.pop()
+        return HandwritingRenderer(self.settings, fonts_dir=self.fonts_dir, asset_catalog=self.asset_catalog)
+
+    def release_renderer(self, renderer, job):
+        """
+        任务结束后放回渲染器。超时或被取消时线程中的排版或渲染可能还没有结束，
+        等线程真正结束后才放回，之后的任务不会在它还在使用时修改设置
+        """
+        if job.future is None:
+            self.put_renderer(renderer)
+        else:
+            # 已经结束时立即调用
+            job.future.add_done_callback(lambda _: self.put_renderer(renderer))
+
+    def put_renderer(self, renderer):
+        with self._lock:
+            self._renderers.append(renderer)
+
+    def release_slot(self, loop):
+        """在线程中的函数结束后释放并发名额，可能在渲染线程中调用"""
+        try:
+            loop.call_soon_threadsafe(self.semaphore.release)
+        except RuntimeError:
+            # 事件循环已经关闭
+            pass
+
+    async def run(self, job, func, *args):
+        """
+        在渲染线程中执行func(job, *args)，执行期间占用一个并发名额；
+        协程被取消或超时时通知线程在下一个检查点停止，线程中的函数真正结束后才释放名额
+        """
+        loop = asyncio.get_running_loop()
+        await self.semaphore.acquire()
+        try:
+            future = job.future = self.executor.submit(func, job, *args)
+        except BaseException:
+            # 线程池已经关闭
+            self.semaphore.release()
+            raise
+        future.add_done_callback(lambda _: self.release_slot(loop))
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            job.cancel()
+            raise
+
+    def layout_job(self, job, renderer, text, settings):
+        """用任务自己的渲染器排版整段文字，返回按需渲染的页面序列"""
+        job.check_cancelled()
+        renderer.update_settings(settings)
+        return renderer.render_pages(text)
+
+    def render_job(self, job, pages, index):
+        job.check_cancelled()
+        return pages[index]
+
+    async def with_timeout(self, coroutine, timeout):
+        if timeout is None:
+            return await coroutine
+        return await asyncio.wait_for(coroutine, timeout)
+
+    async def render_pages(self, text, settings=None, timeout=None):
+        """渲染所有页面，返回图片列表"""
+        return await self.with_timeout(self._render_pages(text, settings), timeout)
+
+    async def _render_pages(self, text, settings):
+        return [img async for img in self.iter_pages(text, settings)]
+
+    async def iter_pages(self, text, settings=None):
+        """逐页渲染，每渲染完一页就返回；等待调用方处理时不占用并发名额"""
+        settings = merge_settings(self.settings, settings or {})
+        job = RenderJob(next(self._job_ids), 'async')
+        renderer = self.acquire_renderer()
+        try:
+            pages = await self.run(job, self.layout_job, renderer, text, settings)
+            for index in range(len(pages)):
+                yield await self.run(job, self.render_job, pages, index)
+        finally:
+            self.release_renderer(renderer, job)
+
+    async def convert(self, text, prefix, settings=None, timeout=None):
+        """
+        渲染并保存所有页面，prefix为不含扩展名的输出路径，如'Output/essay'，返回文件列表。
+        每页渲染后在写文件的线程中编码保存，多页格式逐页追加，不需要同时保留所有页面。
+        超时或被取消时停止渲染，已经写入的文件保留
+        """
+        return await self.with_timeout(self._convert(text, prefix, settings), timeout)
+
+    async def _convert(self, text, prefix, settings):
+        settings = merge_settings(self.settings, settings or {})
+        encoder = get_encoder(settings)
+        job = RenderJob(next(self._job_ids), 'async')
+        loop = asyncio.get_running_loop()
+        directory = os.path.dirname(prefix)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        filenames = []
+        renderer = self.acquire_renderer()
+        pending = None
+        try:
+            pages = await self.run(job, self.layout_job, renderer, text, settings)
+            for index in range(len(pages)):
+                img = await self.run(job, self.render_job, pages, index)
+                filename = encoder.get_filename(prefix, index, len(pages))
+                # 同一时间只写一页，渲染下一页时写入上一页
+                if pending is not None:
+                    await pending
+                pending = loop.run_in_executor(self.io_executor, encoder.save, img, filename,
+                                               encoder.multi_page and index > 0)
+                if filename not in filenames:
+                    filenames.append(filename)
+            if pending is not None:
+                await pending
+        except asyncio.CancelledError:
+            job.cancel()
+            raise
+        finally:
+            self.release_renderer(renderer, job)
+        return filenames
@@ -0,0 +1,160 @@
+"""
+批量转换：把多个.txt文件并行渲染为手写体图片
+
+用法：
+    python batch_convert.py 文章目录/ --settings settings.json
+    python batch_convert.py "texts/*.txt" --output Output --workers 4
+"""
+from handwriting_renderer import HandwritingRenderer, load_settings
+from output_cache import OutputCache
+from output_encoders import get_encoder, write_pages
+import argparse
+import glob
+import multiprocessing
+import os
+import time
+
+# 每个工作进程各自的渲染器，字体和背景在进程内只加载一次
+_renderer = None
+_output_dir = None
+_output_cache = None
+_encoder = None
+# 输入文件 -> 输出文件名（不含扩展名，相对于输出文件夹）
+_output_names = {}
+
+
+def find_text_files(inputs):
+    """把目录、通配符和文件路径展开为.txt文件列表"""
+    files = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            matches = sorted(os.path.join(pattern, name) for name in os.listdir(pattern)
+                             if name.endswith('.txt'))
+        else:
+            matches = sorted(path for path in glob.glob(pattern)
+                             if path.endswith('.txt') and os.path.isfile(path))
+        for path in matches:
+            path = os.path.normpath(path)
+            if path not in files:
+                files.append(path)
+    return files
+
+
+def get_output_names(files):
+    """
+    按相对于所有输入文件共同目录的路径命名输出文件，保留子目录，
+    a/notes.txt和b/notes.txt分别输出为a/notes和b/notes，不会互相覆盖
+    """
+    if not files:
+        return {}
+    paths = [os.path.abspath(path) for path in files]
+    root = os.path.commonpath([os.path.dirname(path) for path in paths])
+    return {path: os.path.splitext(os.path.relpath(abs_path, root))[0]
+            for path, abs_path in zip(files, paths)}
+
+
+def init_worker(settings, fonts_dir, output_dir, use_cache=True, output_names=None):
+    """工作进程初始化：创建渲染器并预先加载字体和背景"""
+    global _renderer, _output_dir, _output_cache, _encoder, _output_names
+    _renderer = HandwritingRenderer(settings, fonts_dir=fonts_dir)
+    _encoder = get_encoder(settings)
+    _output_dir = output_dir
+    _output_names = output_names or {}
+    _output_cache = OutputCache.from_settings(settings) if use_cache else None
+    _renderer.get_font()
+    _renderer.get_base_page()
+
+
+def convert_file(path):
+    """转换一个文件，返回(文件路径, 页数, 耗时, 输出文件列表, 写入的字节数, 错误信息)"""
+    start = time.perf_counter()
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        name = _output_names.get(path) or os.path.splitext(os.path.basename(path))[0]
+        output_subdir = os.path.dirname(os.path.join(_output_dir, name))
+        if not os.path.exists(output_subdir):
+            os.makedirs(output_subdir, exist_ok=True)
+
+        def get_filename(index, count):
+            return _encoder.get_filename(os.path.join(_output_dir, name), index, count)
+
+        with _renderer.profiler.record('batch'):
+            cache_key = None
+            if _output_cache is not None:
+                cache_key = _output_cache.get_key(_renderer, text, _encoder.get_key())
+                filenames = _output_cache.restore(cache_key, get_filename)
+                if filenames:
+                    _renderer.profiler.count('output_cache_hits')
+                    return path, len(filenames), time.perf_counter() - start, filenames, 0, None
+
+            pages = _renderer.render_pages(text)
+            page_filenames = [get_filename(index, len(pages)) for index in range(len(pages))]
+            encoded_bytes = sum(size for _, _, size in write_pages(_encoder, pages, page_filenames,
+                                                                   _renderer.profiler))
+            filenames = list(dict.fromkeys(page_filenames))
+
+            if _output_cache is not None:
+                _output_cache.put(cache_key, filenames)
+        return path, len(pages), time.perf_counter() - start, filenames, encoded_bytes, None
+    except Exception as e:
+        return path, 0, time.perf_counter() - start, [], 0, str(e)
+
+
+def batch_convert(files, settings, fonts_dir='fonts', output_dir='Output', workers=None, use_cache=True):
+    """用进程池并行转换所有文件，按完成顺序返回结果"""
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    workers = workers or os.cpu_count() or 1
+    output_names = get_output_names(files)
+    with multiprocessing.Pool(workers, initializer=init_worker,
+                              initargs=(settings, fonts_dir, output_dir, use_cache, output_names)) as pool:
+        for result in pool.imap_unordered(convert_file, files):
+            yield result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量把文本文件转换为手写体图片")
+    parser.add_argument('inputs', nargs='+', help="包含.txt文件的目录、通配符或文件路径")
+    parser.add_argument('--settings', default='settings.json', help="设置文件，默认settings.json")
+    parser.add_argument('--fonts', default='fonts', help="字体文件夹，默认fonts")
+    parser.add_argument('--output', default='Output', help="输出文件夹，默认Output")
+    parser.add_argument('--workers', type=int, default=None, help="进程数，默认为CPU核心数")
+    parser.add_argument('--format', choices=['png', 'jpeg', 'webp', 'pdf'], help="输出格式，默认使用设置中的output项")
+    parser.add_argument('--no-cache', action='store_true', help="不使用生成结果缓存，总是重新渲染")
+    parser.add_argument('--purge-cache', action='store_true', help="转换前清空生成结果缓存")
+    args = parser.parse_args(argv)
+
+    files = find_text_files(args.inputs)
+    if not files:
+        print("没有找到要转换的.txt文件")
+        return 1
+
+    settings = load_settings(args.settings)
+    if args.format:
+        settings['output'] = dict(settings.get('output') or {}, format=args.format)
+    if args.purge_cache:
+        OutputCache().purge()
+    total_pages = 0
+    total_bytes = 0
+    failed = 0
+    start = time.perf_counter()
+    for path, page_count, seconds, filenames, encoded_bytes, error in batch_convert(files, settings, args.fonts,
+                                                                     args.output, args.workers,
+                                                                     not args.no_cache):
+        if error:
+            failed += 1
+            print(f"转换失败 {path}: {error}")
+        else:
+            total_pages += page_count
+            total_bytes += encoded_bytes
+            print(f"{path}: {page_count}页，耗时{seconds:.2f}秒，写入{encoded_bytes / 1024:.0f}KB")
+    elapsed = time.perf_counter() - start
+
+    print(f"共转换{len(files) - failed}个文件，{total_pages}页，总耗时{elapsed:.2f}秒，"
+          f"{total_pages / elapsed if elapsed else 0:.2f}页/秒，共写入{total_bytes / 1024 / 1024:.2f}MB")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
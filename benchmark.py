@@ -0,0 +1,242 @@
+"""
+渲染性能基准测试：用固定的测试文本，对fonts/中的每种字体和background/中的每种纸张进行渲染，
+记录延迟分位数、峰值内存和每秒渲染的字数，并与保存的基准结果比较
+
+用法：
+    python benchmark.py                       # 运行并与benchmark_baseline.json比较
+    python benchmark.py --save-baseline       # 运行并保存为新的基准
+    python benchmark.py --fonts 青叶手写体.ttf --backgrounds A4纯白.jpg --repeat 10
+    python benchmark.py --encoders png jpeg webp pdf   # 同时比较各输出格式的编码耗时和文件大小
+"""
+from handwriting_renderer import HandwritingRenderer, load_settings
+from output_encoders import ENCODERS
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+try:
+    import resource
+except ImportError:
+    # Windows没有resource模块，不记录峰值内存
+    resource = None
+
+# 生成测试文本用的常用汉字
+COMMON_HANZI = ('的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方后多定行学法所民得经'
+                '十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处队南给色光门即保治北造百规热领七海口东导器压志世金增争济阶油思术极交受联什认六共权收证改清己美再采转更单风切打白教速花带安场身车例真务具万每目至达走积示议声报斗完类八离华名确才科张信马节话米整空元况今集温传土许步群广石记需段研界拉林律叫且究观越织装影算低持音众书布复容儿须际商非验连断深难近矿千周委素技备半办青省列习响约支般史感劳便团往酸历市克何除消构府称太准精值号率族维划选标写存候毛亲快效斯院查江型眼王按格养易置派层片始却专状育厂京识适属圆包火住调满县局照参红细引听该铁价严')
+LATIN_WORDS = ['the', 'quick', 'brown', 'fox', 'jumps', 'over', 'lazy', 'dog', 'Python', 'PIL', '2024', '3.14', 'OK']
+CJK_PUNCTUATION = '，。！？、；：“”（）《》…—'
+
+
+def make_corpus():
+    """固定的测试文本，每次运行完全相同"""
+    rng = random.Random(20240417)
+
+    def essay(length):
+        chars = []
+        while len(chars) < length:
+            sentence = ''.join(rng.choice(COMMON_HANZI) for _ in range(rng.randint(8, 24)))
+            chars.extend(sentence + rng.choice('，。！？'))
+            if rng.random() < 0.08:
+                chars.append('\n')
+        return ''.join(chars[:length])
+
+    def mixed(length):
+        parts = []
+        while sum(len(part) for part in parts) < length:
+            kind = rng.random()
+            if kind < 0.5:
+                parts.append(''.join(rng.choice(COMMON_HANZI) for _ in range(rng.randint(3, 12))))
+            elif kind < 0.8:
+                parts.append(' ' + ' '.join(rng.choice(LATIN_WORDS) for _ in range(rng.randint(1, 4))) + ' ')
+            else:
+                parts.append(rng.choice(CJK_PUNCTUATION))
+        return ''.join(parts)[:length]
+
+    return {
+        'short_note': "明天上午九点开会，请带好笔记本。\n记得交作业！",
+        'essay_3000': essay(3000),
+        'mixed_1000': mixed(1000),
+        'overflow_20000': essay(20000)
+    }
+
+
+def get_peak_rss_mb():
+    """进程的峰值内存（MB），无法获取时返回None"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS单位为字节，Linux为KB
+    if sys.platform == 'darwin':
+        return round(peak / 1024 / 1024, 1)
+    return round(peak / 1024, 1)
+
+
+def reset_peak_rss():
+    """重置进程的峰值内存，之后读取的峰值只包含当前用例；只有Linux支持，不支持时返回False"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+def run_case(renderer, text, repeat):
+    """
+    渲染一个测试用例，第一次为冷启动（清空缓存），其余为热缓存。
+    峰值内存只在能够重置峰值的系统上按用例记录，否则为None
+    """
+    latencies = []
+    glyphs = 0
+    per_case_rss = reset_peak_rss()
+    for iteration in range(repeat + 1):
+        if iteration == 0:
+            # 字形、变体、字体、背景、字符尺寸表、字符位图和回退链全部清空
+            renderer.clear_caches()
+        # 每次都重新排版，排版结果缓存只在交互预览时有意义
+        renderer.plan_cache.clear()
+        start = time.perf_counter()
+        pages = renderer.render_pages(text)
+        for img in pages:
+            # 逐页渲染，渲染完即丢弃
+            pass
+        latencies.append((time.perf_counter() - start) * 1000)
+        glyphs = sum(len(page) for page in pages.pages)
+    warm = latencies[1:] or latencies
+    return {
+        'pages': len(pages),
+        'glyphs': glyphs,
+        'cold_ms': round(latencies[0], 2),
+        'p50_ms': round(percentile(warm, 0.5), 2),
+        'p90_ms': round(percentile(warm, 0.9), 2),
+        'p99_ms': round(percentile(warm, 0.99), 2),
+        'glyphs_per_second': round(glyphs / (sum(warm) / len(warm) / 1000), 1) if sum(warm) else None,
+        'peak_rss_mb': get_peak_rss_mb() if per_case_rss else None
+    }
+
+
+def run_encoders(renderer, text, formats, repeat):
+    """用每种输出格式保存第一页，记录编码耗时中位数和文件大小"""
+    img = renderer.render(text)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for output_format in formats:
+            encoder = ENCODERS[output_format]()
+            filename = os.path.join(directory, f'page{encoder.extension}')
+            latencies = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                size = encoder.save(img, filename)
+                latencies.append((time.perf_counter() - start) * 1000)
+            results[output_format] = {'encode_ms': round(percentile(latencies, 0.5), 2), 'bytes': size}
+    return results
+
+
+def run_benchmark(settings, fonts, backgrounds, fonts_dir='fonts', background_dir='background', repeat=5,
+                  cases=None, encoders=None):
+    corpus = make_corpus()
+    if cases:
+        corpus = {name: text for name, text in corpus.items() if name in cases}
+    results = {}
+    for font in fonts:
+        for background in backgrounds:
+            case_settings = dict(settings, handwriting_font=font, seed=1,
+                                 background=dict(settings.get('background', {}),
+                                                 current=os.path.join(background_dir, background)))
+            renderer = HandwritingRenderer(case_settings, fonts_dir=fonts_dir)
+            for name, text in corpus.items():
+                key = f'{name}|{font}|{background}'
+                results[key] = run_case(renderer, text, repeat)
+                print(f"{key}: p50 {results[key]['p50_ms']}ms，{results[key]['glyphs_per_second']}字/秒")
+                if encoders:
+                    results[key]['encoders'] = run_encoders(renderer, text, encoders, repeat)
+                    for output_format, result in results[key]['encoders'].items():
+                        print(f"    {output_format}: 编码{result['encode_ms']}ms，{result['bytes'] / 1024:.0f}KB")
+    return results
+
+
+def compare(results, baseline, threshold):
+    """与基准比较p50延迟和峰值内存，增加超过threshold的用例视为性能回退"""
+    regressions = []
+    for key, result in results.items():
+        old = baseline.get('results', {}).get(key)
+        if not old:
+            continue
+        for field, unit in (('p50_ms', 'ms'), ('peak_rss_mb', 'MB')):
+            if not old.get(field) or result.get(field) is None:
+                continue
+            change = result[field] / old[field] - 1
+            if change > threshold:
+                regressions.append((key, f'{old[field]}{unit}', f'{result[field]}{unit}', change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="手写渲染性能基准测试")
+    parser.add_argument('--settings', default='settings.json', help="基础设置文件，字体和背景会被逐一替换")
+    parser.add_argument('--fonts', nargs='*', help="只测试这些字体文件名，默认fonts/中的全部字体")
+    parser.add_argument('--backgrounds', nargs='*', help="只测试这些背景文件名，默认background/中的全部背景")
+    parser.add_argument('--cases', nargs='*', help="只运行这些测试文本：short_note essay_3000 mixed_1000 overflow_20000")
+    parser.add_argument('--encoders', nargs='*', choices=['png', 'jpeg', 'webp', 'pdf'],
+                        help="比较这些输出格式保存第一页的耗时和文件大小")
+    parser.add_argument('--repeat', type=int, default=5, help="每个用例热缓存下的重复次数，默认5")
+    parser.add_argument('--output', default='benchmark_results.json', help="结果文件")
+    parser.add_argument('--baseline', default='benchmark_baseline.json', help="基准结果文件")
+    parser.add_argument('--save-baseline', action='store_true', help="把本次结果保存为基准")
+    parser.add_argument('--threshold', type=float, default=0.2, help="p50延迟或峰值内存增加超过该比例视为回退，默认0.2")
+    args = parser.parse_args(argv)
+
+    fonts = args.fonts or sorted(f for f in os.listdir('fonts') if f.endswith(('.ttf', '.ttc', '.otf')))
+    backgrounds = args.backgrounds or sorted(f for f in os.listdir('background')
+                                             if f.endswith(('.png', '.jpg', '.jpeg')))
+    settings = load_settings(args.settings)
+
+    results = run_benchmark(settings, fonts, backgrounds, repeat=args.repeat, cases=args.cases,
+                            encoders=args.encoders)
+    report = {
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        # 按用例记录时每个用例开始前峰值被重置，整个进程的峰值取所有用例中的最大值
+        'peak_rss_mb': max([get_peak_rss_mb() or 0] + [result['peak_rss_mb'] or 0 for result in results.values()])
+                       if resource is not None else None,
+        'results': results
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    print(f"结果已保存至：{args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+        print(f"基准已保存至：{args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("没有基准结果，使用--save-baseline保存本次结果作为基准")
+        return 0
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    for key, old, new, change in regressions:
+        print(f"性能回退 {key}: {old} -> {new} (+{change:.0%})")
+    if not regressions:
+        print("没有发现性能回退")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,156 @@
+"""
+字体回退：手写体缺少某个字符的字形时，依次使用回退链中第一个包含该字形的字体，不再画出方框。
+每个字体包含哪些字符使用素材目录中记录的字符范围：手写体的范围展开为位图，查询一个字符只需一次位运算；
+回退字体只在遇到手写体缺少的字符时才按范围查询
+"""
+from render_cache import LRUCache
+import os
+import threading
+
+# Unicode码位上限，每个码位占一位
+MAX_CODE = 0x110000
+
+
+class FontCoverage:
+    """一个字体包含字形的字符集合，按码位保存为位图"""
+
+    __slots__ = ('bits',)
+
+    def __init__(self, bits=None):
+        self.bits = bits if bits is not None else bytearray(MAX_CODE // 8)
+
+    @classmethod
+    def from_ranges(cls, ranges):
+        """由[[起始, 结束], ...]（含结束）生成位图，整字节直接填充"""
+        coverage = cls()
+        bits = coverage.bits
+        for start, end in ranges:
+            end = min(end, MAX_CODE - 1)
+            while start <= end and start & 7:
+                bits[start >> 3] |= 1 << (start & 7)
+                start += 1
+            full_end = (end + 1) >> 3
+            if start >> 3 < full_end:
+                bits[start >> 3:full_end] = b'\xff' * (full_end - (start >> 3))
+                start = full_end << 3
+            while start <= end:
+                bits[start >> 3] |= 1 << (start & 7)
+                start += 1
+        return coverage
+
+    def __contains__(self, char):
+        code = ord(char)
+        return code < MAX_CODE and self.bits[code >> 3] >> (code & 7) & 1 == 1
+
+
+def get_catalog_name(catalog, path):
+    """字体文件在素材目录中的文件名，不在字体文件夹中（如系统字体msyh.ttc）时返回None"""
+    if not isinstance(path, str):
+        return None
+    directory, name = os.path.split(path)
+    if os.path.abspath(directory) != os.path.abspath(catalog.fonts_dir) or catalog.get_font_info(name) is None:
+        return None
+    return name
+
+
+class CoverageStore(LRUCache):
+    """进程内的字符位图缓存，由素材目录中的字符范围生成，按(字体文件夹, 文件名, 修改时间, 大小)区分"""
+
+    def get_coverage(self, catalog, name):
+        """返回字体的FontCoverage，素材目录中没有该字体的字符范围时返回None"""
+        entry = catalog.get_font_info(name) if name else None
+        if not entry or 'coverage' not in entry:
+            return None
+        key = (os.path.abspath(catalog.fonts_dir), name, entry['mtime'], entry['size'])
+        coverage = self.get(key)
+        if coverage is None:
+            coverage = FontCoverage.from_ranges(entry['coverage'])
+            self.put(key, coverage)
+        return coverage
+
+
+class FontChain:
+    """
+    一个字号的字体回退链：每个字符使用第一个包含该字形的字体，都没有时使用手写体。
+    回退字体的字符范围和字体本身都在第一次用到时才查询和加载，竖直方向按基线对齐
+    """
+
+    def __init__(self, font, fallbacks, load_font, metrics_store, catalog, coverage_store):
+        self.font = font
+        self.load_font = load_font
+        self.metrics_store = metrics_store
+        self.metrics = metrics_store.get_metrics(font)
+        self.catalog = catalog
+        # 素材目录中没有字符范围的字体视为包含所有字符
+        self.coverage = coverage_store.get_coverage(catalog, get_catalog_name(catalog, getattr(font, 'path', None)))
+        # 排版时每个字符都要查询，直接使用位图
+        self._bits = self.coverage.bits if self.coverage is not None else None
+        # [路径, 素材目录中的文件名, 是否可用, (字体, 基线偏移, 尺寸表)]，字体在第一次用到时才加载
+        self.fallbacks = [[fallback_path, None, True, None] for fallback_path in fallbacks]
+        self._names_resolved = False
+        self.primary = (font, 0, self.metrics)
+        # 需要回退的字符 -> (字体, 基线偏移, 尺寸表)
+        self._choices = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, char):
+        """返回绘制该字符使用的(字体, 竖直偏移, 尺寸表)"""
+        code = ord(char)
+        if self._bits is None or self._bits[code >> 3] >> (code & 7) & 1:
+            return self.primary
+        choice = self._choices.get(char)
+        if choice is None:
+            choice = self._choices[char] = self.find_fallback(char)
+        return choice
+
+    def find_fallback(self, char):
+        if not self._names_resolved:
+            # 第一次遇到手写体缺少的字符时才查找回退字体在素材目录中的记录
+            for entry in self.fallbacks:
+                entry[1] = get_catalog_name(self.catalog, entry[0])
+            self._names_resolved = True
+        has_char = self.catalog.has_char
+        for entry in self.fallbacks:
+            fallback_path, name, usable, choice = entry
+            # 不在素材目录中的字体（如系统字体）视为包含所有字符
+            if not usable or (name is not None and not has_char(name, char)):
+                continue
+            if choice is None:
+                with self._lock:
+                    choice = self.load_entry(entry)
+                if choice is None:
+                    continue
+            return choice
+        # 回退链中都没有该字形，仍使用手写体
+        return self.primary
+
+    def load_entry(self, entry):
+        if entry[3] is None and entry[2]:
+            try:
+                font = self.load_font(entry[0])
+                # 回退字体的基线与手写体的基线对齐
+                offset = self.font.getmetrics()[0] - font.getmetrics()[0]
+                entry[3] = (font, offset, self.metrics_store.get_metrics(font))
+            except Exception as e:
+                print(f"加载回退字体失败: {str(e)}")
+                # 不再尝试加载
+                entry[2] = False
+        return entry[3]
+
+    def width(self, char):
+        """字符的墨迹宽度，缺字时按回退字体测量"""
+        code = ord(char)
+        if self._bits is None or self._bits[code >> 3] >> (code & 7) & 1:
+            return self.metrics.width(char)
+        return self.resolve(char)[2].width(char)
+
+    def save(self):
+        """保存回退链中所有用到的字体的字符尺寸表"""
+        self.metrics.save()
+        for entry in self.fallbacks:
+            if entry[3] is not None:
+                entry[3][2].save()
+
+
+# 进程内共享的字符位图
+coverage_store = CoverageStore()
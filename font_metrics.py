@@ -0,0 +1,130 @@
+from render_cache import LRUCache
+from array import array
+import hashlib
+import os
+import threading
+
+# 字符尺寸表保存的位置
+METRICS_DIR = os.path.join('cache', 'font_metrics')
+
+# 每块256个字符，每个字符保存 左、上、右、下、步进宽度
+BLOCK_SIZE = 256
+FIELDS = 5
+NAN = float('nan')
+
+
+class FontMetrics:
+    """一个(字体, 字号)的字符尺寸表，排版时查表代替FreeType测量，用到的字符才计算并保存到磁盘"""
+
+    def __init__(self, font, path=None):
+        self.font = font
+        # 保存到磁盘的文件路径，内置字体为None
+        self.path = path
+        self.blocks = {}
+        self.dirty = False
+        self._lock = threading.Lock()
+
+    def get_entry(self, char):
+        """返回(尺寸块, 偏移)，字符未计算过时先用FreeType测量一次"""
+        code = ord(char)
+        block = self.blocks.get(code // BLOCK_SIZE)
+        if block is None:
+            block = self.blocks[code // BLOCK_SIZE] = array('f', [NAN]) * (BLOCK_SIZE * FIELDS)
+        offset = (code % BLOCK_SIZE) * FIELDS
+        if block[offset] != block[offset]:
+            self.measure(char, block, offset)
+        return block, offset
+
+    def measure(self, char, block, offset):
+        try:
+            values = (*self.font.getbbox(char), self.font.getlength(char))
+        except Exception:
+            # 无法编码的字符（如单独的代理项）按空白处理
+            values = (0, 0, 0, 0, 0)
+        with self._lock:
+            block[offset:offset + FIELDS] = array('f', values)
+            self.dirty = True
+
+    def width(self, char):
+        """字符的墨迹宽度，等同于textbbox的右减左"""
+        block, offset = self.get_entry(char)
+        return block[offset + 2] - block[offset]
+
+    def warm(self, ranges=((0x20, 0x7F), (0x3000, 0x3040), (0xFF00, 0xFFF0))):
+        """预先计算常用范围内的字符，默认为ASCII和中文标点"""
+        for start, end in ranges:
+            for code in range(start, end):
+                self.get_entry(chr(code))
+
+    def save(self):
+        """保存到磁盘，只在有新测量的字符时写入"""
+        if not self.path or not self.dirty:
+            return
+        with self._lock:
+            data = b''.join(index.to_bytes(4, 'little') + block.tobytes()
+                            for index, block in sorted(self.blocks.items()))
+            self.dirty = False
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        temp_path = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"保存字符尺寸表失败: {str(e)}")
+
+    def load(self):
+        """从磁盘读取之前测量过的字符"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        block_bytes = BLOCK_SIZE * FIELDS * 4
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            for start in range(0, len(data) - block_bytes - 3, block_bytes + 4):
+                block = array('f')
+                block.frombytes(data[start + 4:start + 4 + block_bytes])
+                self.blocks[int.from_bytes(data[start:start + 4], 'little')] = block
+        except (OSError, ValueError) as e:
+            print(f"读取字符尺寸表失败: {str(e)}")
+            self.blocks = {}
+
+
+class MetricsStore(LRUCache):
+    """进程内的字符尺寸表缓存，按(字体文件, 字号, 修改时间)区分"""
+
+    def __init__(self, max_size=16, metrics_dir=METRICS_DIR):
+        super().__init__(max_size)
+        self.metrics_dir = metrics_dir
+
+    def get_metrics(self, font):
+        path = getattr(font, 'path', None)
+        if not isinstance(path, str):
+            # 内置字体没有文件，只在内存中缓存
+            key = (id(font), getattr(font, 'size', 0))
+            metrics = self.get(key)
+            if metrics is None or metrics.font is not font:
+                metrics = FontMetrics(font)
+                self.put(key, metrics)
+            return metrics
+
+        try:
+            stat = os.stat(path)
+            file_key = (os.path.abspath(path), stat.st_mtime, stat.st_size)
+        except OSError:
+            # 系统字体（如msyh.ttc）不在当前目录，按名称保存
+            file_key = (path, None, None)
+        key = (file_key, font.size, getattr(font, 'index', 0))
+        metrics = self.get(key)
+        if metrics is None:
+            digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+            metrics = FontMetrics(font, os.path.join(self.metrics_dir, f'{digest}.bin'))
+            metrics.load()
+            self.put(key, metrics)
+        return metrics
+
+
+# 进程内共享的字符尺寸表
+metrics_store = MetricsStore()
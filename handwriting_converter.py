@@ -3,11 +3,18 @@ from tkinter import ttk
 from tkinter import messagebox
 from tkinter import colorchooser
 import tkinter.font as tkfont
-from PIL import Image, ImageTk, ImageDraw, ImageFont
+from PIL import ImageTk
 import os
 from datetime import datetime
-import random
-import json
+from handwriting_renderer import HandwritingRenderer
+from live_preview import LivePreview
+from render_worker import RenderWorker
+from output_cache import OutputCache
+from parallel_render import save_pages
+from output_encoders import ENCODERS, get_encoder
+from settings_store import SettingsStore
+from asset_catalog import AssetCatalog
+from asset_thumbnails import ThumbnailCache
 
 class RoundedButton(tk.Canvas):
     def __init__(self, parent, text, command=None, radius=20, padding=8, bg='#6c5ce7', fg='white', hover_bg='#a29bfe', **kwargs):
@@ -109,6 +116,12 @@ class HandwritingConverter:
         self.text_color = '#2d3436'
         self.root.configure(bg=self.bg_color)
         
+        # 字体和背景的目录，只重新读取新增或修改过的文件
+        self.asset_catalog = AssetCatalog(self.fonts_dir, self.background_dir)
+        self.asset_catalog.refresh()
+        # 设置窗口中字体示例和背景缩略图，在后台生成
+        self.thumbnail_cache = ThumbnailCache()
+        
         # 初始化字体和背景
         self.init_fonts()
         self.init_background()
@@ -117,8 +130,34 @@ class HandwritingConverter:
         self.init_chaos_level()
         self.init_margins()  # 初始化边距设置
         
-        # 加载保存的设置
+        # 加载保存的设置，之后的修改合并后在后台写入
+        self.settings_store = SettingsStore('settings.json')
         self.load_settings()
+        # 打开的设置窗口用来重新显示设置的函数，窗口关闭后为None
+        self.refresh_settings_dialog = None
+        
+        # 渲染引擎，只在后台渲染线程中使用
+        self.renderer = HandwritingRenderer(self.get_settings(), fonts_dir=self.fonts_dir,
+                                            default_font=self.fonts['default'], asset_catalog=self.asset_catalog)
+        
+        # 生成结果缓存，设置了随机种子时重复转换相同的文字直接复制之前的图片
+        self.output_cache = OutputCache.from_settings(self.get_settings())
+        
+        # 实时预览，输入停止一段时间后只重新渲染改动的行
+        self.live_preview = LivePreview(self.renderer)
+        self.live_preview_job = None
+        self.preview_tiles = []
+        # 当前显示的预览图，只在界面线程中使用
+        self.shown_preview_img = None
+        
+        # 后台渲染线程，界面线程定时取回进度和结果
+        self.render_worker = RenderWorker()
+        self.convert_job = None
+        self.progress_window = None
+        self.root.after(50, self.poll_render_worker)
+        
+        # 定时检查settings.json是否被其他程序修改
+        self.root.after(1000, self.check_settings_file)
         
         # 设置整体样式
         style = ttk.Style()
@@ -276,6 +315,9 @@ class HandwritingConverter:
         # 绑定窗口关闭事件，解除鼠标滚轮绑定
         def on_closing():
             self.preview_area.unbind_all("<MouseWheel>")
+            self.render_worker.shutdown()
+            self.thumbnail_cache.shutdown()
+            self.settings_store.close()
             self.root.destroy()
             
         self.root.protocol("WM_DELETE_WINDOW", on_closing)
@@ -296,8 +338,8 @@ class HandwritingConverter:
         # 绑定事件
         self.text_input.bind('<Key>', self.on_text_change)
         
-    def save_settings(self):
-        """保存设置到文件"""
+    def get_settings(self):
+        """获取当前设置（结构与settings.json相同）"""
         settings = {
             'font_size': getattr(self, 'font_size', 36),
             'text_color': self.text_color_settings['color'],
@@ -307,6 +349,7 @@ class HandwritingConverter:
                 'vertical': self.text_spacing['vertical']
             },
             'chaos_level': self.chaos_level,
+            'seed': self.seed,
             'margins': {
                 'left': int(self.margins['left']),  # 确保保存为整数
                 'right': int(self.margins['right']),
@@ -323,124 +366,191 @@ class HandwritingConverter:
         if self.fonts['handwriting']:
             settings['handwriting_font'] = os.path.basename(self.fonts['handwriting'])
             
-        try:
-            with open('settings.json', 'w', encoding='utf-8') as f:
-                json.dump(settings, f, ensure_ascii=False, indent=4)
-        except Exception as e:
-            print(f"保存设置失败: {str(e)}")
+        # 性能统计设置只能手动写入settings.json，原样保留
+        if getattr(self, 'profile_settings', None):
+            settings['profile'] = self.profile_settings
+        if getattr(self, 'output_cache_settings', None):
+            settings['output_cache'] = self.output_cache_settings
+        if getattr(self, 'output_settings', None):
+            settings['output'] = self.output_settings
+        if getattr(self, 'fallback_fonts', None) is not None:
+            settings['fallback_fonts'] = self.fallback_fonts
+        if getattr(self, 'glyph_variants', None) is not None:
+            settings['glyph_variants'] = self.glyph_variants
+        return settings
+        
+    def save_settings(self):
+        """保存设置，连续修改时只在停止修改后写入一次文件"""
+        self.settings_store.save(self.get_settings())
             
     def load_settings(self):
         """从文件加载设置"""
         try:
-            if os.path.exists('settings.json'):
-                with open('settings.json', 'r', encoding='utf-8') as f:
-                    settings = json.load(f)
-                    
-                # 加载字体大小
-                self.font_size = settings.get('font_size', 36)
-                
-                # 加载文字颜色设置
-                self.text_color_settings['color'] = settings.get('text_color', '#000000')
-                self.text_color_settings['opacity'] = settings.get('text_opacity', 1.0)
-                
-                # 加载文字间距
-                spacing_settings = settings.get('text_spacing', {})
-                self.text_spacing['horizontal'] = spacing_settings.get('horizontal', 0)
-                self.text_spacing['vertical'] = spacing_settings.get('vertical', 10)
-                
-                # 加载字体混乱度
-                self.chaos_level = settings.get('chaos_level', 5)
-                
-                # 加载边距设置
-                margins_settings = settings.get('margins', {})
-                self.margins['left'] = int(margins_settings.get('left', 50))  # 确保加载为整数
-                self.margins['right'] = int(margins_settings.get('right', 50))
-                self.margins['top'] = int(margins_settings.get('top', 50))
-                self.margins['bottom'] = int(margins_settings.get('bottom', 50))
-                
-                # 加载背景设置
-                bg_settings = settings.get('background', {})
-                self.background['current'] = bg_settings.get('current')
-                self.background['color'] = bg_settings.get('color', '#faf9de')
-                
-                # 加载手写体字体
-                if 'handwriting_font' in settings:
-                    font_path = os.path.join(self.fonts_dir, settings['handwriting_font'])
-                    if os.path.exists(font_path):
-                        self.fonts['handwriting'] = font_path
+            settings = self.settings_store.load()
+            if settings is not None:
+                self.apply_settings(settings)
         except Exception as e:
             print(f"加载设置失败: {str(e)}")
             
+    def check_settings_file(self):
+        """settings.json被其他程序修改后，不需要重启即可应用新的设置"""
+        settings = self.settings_store.check_external_change()
+        if settings is not None:
+            try:
+                self.apply_settings(settings)
+                # 设置窗口中的旧值不能在下次自动保存时覆盖外部修改
+                if self.refresh_settings_dialog is not None:
+                    self.refresh_settings_dialog()
+                self.on_settings_change()
+            except Exception as e:
+                print(f"加载设置失败: {str(e)}")
+        self.root.after(1000, self.check_settings_file)
+            
+    def apply_settings(self, settings):
+        """应用一份设置（结构与settings.json相同）"""
+        # 加载字体大小
+        self.font_size = settings.get('font_size', 36)
+        
+        # 加载文字颜色设置
+        self.text_color_settings['color'] = settings.get('text_color', '#000000')
+        self.text_color_settings['opacity'] = settings.get('text_opacity', 1.0)
+        
+        # 加载文字间距
+        spacing_settings = settings.get('text_spacing', {})
+        self.text_spacing['horizontal'] = spacing_settings.get('horizontal', 0)
+        self.text_spacing['vertical'] = spacing_settings.get('vertical', 10)
+        
+        # 加载字体混乱度
+        self.chaos_level = settings.get('chaos_level', 5)
+        
+        # 加载随机种子
+        self.seed = settings.get('seed')
+        
+        # 加载性能统计设置
+        self.profile_settings = settings.get('profile')
+        self.output_cache_settings = settings.get('output_cache')
+        
+        # 加载输出格式设置
+        self.output_settings = settings.get('output')
+        
+        # 缺字时使用的回退字体，只能手动写入settings.json
+        self.fallback_fonts = settings.get('fallback_fonts')
+        
+        # 每个字形的变体数量，只能手动写入settings.json
+        self.glyph_variants = settings.get('glyph_variants')
+        
+        # 加载边距设置
+        margins_settings = settings.get('margins', {})
+        self.margins['left'] = int(margins_settings.get('left', 50))  # 确保加载为整数
+        self.margins['right'] = int(margins_settings.get('right', 50))
+        self.margins['top'] = int(margins_settings.get('top', 50))
+        self.margins['bottom'] = int(margins_settings.get('bottom', 50))
+        
+        # 加载背景设置
+        bg_settings = settings.get('background', {})
+        self.background['current'] = bg_settings.get('current')
+        self.background['color'] = bg_settings.get('color', '#faf9de')
+        
+        # 加载手写体字体
+        if 'handwriting_font' in settings:
+            font_path = os.path.join(self.fonts_dir, settings['handwriting_font'])
+            if os.path.exists(font_path):
+                self.fonts['handwriting'] = font_path
+            
     def on_closing(self):
         """窗口关闭时的处理"""
         self.save_settings()  # 保存设置
+        self.thumbnail_cache.shutdown()
+        self.settings_store.close()  # 立即写入尚未保存的设置
         self.root.destroy()  # 关闭窗口
         
     def on_text_change(self, event=None):
-        # 不再自动清除预览区域
-        pass
-        
-    def process_text(self, draw, text, font, available_width, available_height, text_height, text_color, opacity):
-        """处理文本的通用方法"""
-        y = self.margins['top']
-        lines = text.split('\n')
+        # 防抖：连续输入时只在停顿后更新一次预览
+        if self.live_preview_job is not None:
+            self.root.after_cancel(self.live_preview_job)
+        self.live_preview_job = self.root.after(300, self.update_live_preview)
+        
+    def on_settings_change(self):
+        """设置改变后取消过时的预览任务，并按新设置刷新预览"""
+        self.render_worker.cancel('preview')
+        self.render_worker.cancel('live')
+        self.on_text_change()
+        
+    def update_live_preview(self):
+        """实时预览，只刷新预览中改动过的区域"""
+        self.live_preview_job = None
+        text = self.text_input.get("1.0", tk.END)
+        if not text.strip():
+            return
+        # 尚未开始的实时预览任务已经过时，最新的文本包含了所有改动
+        self.render_worker.cancel('live')
+        self.render_worker.submit('live', self.render_live_preview, text, self.get_settings())
         
-        # 使用一个字符的1/4宽度作为空格宽度
-        char_bbox = draw.textbbox((0, 0), "字", font=font)
-        space_width = (char_bbox[2] - char_bbox[0]) * 0.25  # 缩小为1/4宽度
+    def render_live_preview(self, job, progress, text, settings):
+        """在后台线程中更新实时预览"""
+        self.renderer.update_settings(settings)
+        return self.live_preview.update(text)
         
-        # 定义标点符号列表
-        punctuation = '，。！？、；：""''（）《》【】…—'
+    def reset_live_preview(self):
+        """预览内容被替换后，实时预览下次需要整页刷新"""
+        self.render_worker.submit('live_reset', lambda job, progress: self.live_preview.reset())
         
-        for line in lines:
-            if y > available_height:
-                break
-            
-            x = self.margins['left']
-            
-            # 遍历每个字符
-            for char in line:
-                # 获取字符宽度
-                if char == ' ':
-                    # 如果是空格，不绘制任何内容，只移动x坐标
-                    x += space_width + self.text_spacing['horizontal']
-                    continue
-                
-                # 获取字符的实际宽度
-                char_bbox = draw.textbbox((0, 0), char, font=font)
-                char_width = char_bbox[2] - char_bbox[0]
-                
-                # 如果是标点符号，减小占位宽度
-                if char in punctuation:
-                    char_width = char_width * 0.5  # 标点符号宽度减半
-                
-                # 检查是否需要换行
-                if x + char_width > available_width - self.margins['right']:
-                    # 移动到下一行
-                    y += text_height + self.text_spacing['vertical']
-                    x = self.margins['left']
-                    
-                    if y > available_height:
-                        break
-                
-                # 添加随机偏移
-                draw_x = x + self.get_random_offset(self.chaos_level)
-                draw_y = y + self.get_random_offset(self.chaos_level)
-                
-                # 绘制字符
-                draw.text((draw_x, draw_y), char, font=font, fill=text_color + hex(opacity)[2:].zfill(2))
-                
-                # 更新x坐标
-                x += char_width + self.text_spacing['horizontal']
+    def poll_render_worker(self):
+        """定时取回后台渲染的进度和结果"""
+        try:
+            for event, job, data in self.render_worker.poll():
+                self.handle_render_message(event, job, data)
+        finally:
+            self.root.after(50, self.poll_render_worker)
             
-            # 移动到下一行
-            y += text_height + self.text_spacing['vertical']
+    def handle_render_message(self, event, job, data):
+        """在界面线程中处理后台渲染的消息"""
+        if job.kind == 'convert':
+            if job is not self.convert_job:
+                return
+            if event == 'progress':
+                self.progress_var.set(data)
+                return
+            self.convert_job = None
+            self.close_progress_window()
+            if event == 'done':
+                filenames, preview_img = data
+                if len(filenames) == 1:
+                    messagebox.showinfo("成功", f"手写体图片已保存至：{filenames[0]}")
+                else:
+                    messagebox.showinfo("成功", f"共{len(filenames)}页手写体图片已保存至：{self.output_dir}")
+                # 更新预览
+                self.show_preview_image(preview_img)
+                self.reset_live_preview()
+            elif event == 'error':
+                print(f"转换文字失败: {str(data)}")
+                messagebox.showerror("错误", f"转换文字失败: {str(data)}")
+        elif job.kind == 'preview':
+            if event == 'done' and not job.cancelled:
+                self.show_preview_image(data)
+                self.reset_live_preview()
+            elif event == 'error':
+                print(f"生成预览图片失败: {str(data)}")
+                messagebox.showerror("错误", f"生成预览图片失败: {str(data)}")
+        elif job.kind == 'live':
+            # 实时预览的状态已经更新，即使任务被标记为取消也要显示结果
+            if event == 'done':
+                full, preview_img, tiles = data
+                if full:
+                    self.show_preview_image(preview_img)
+                else:
+                    for box, tile in tiles:
+                        self.show_preview_tile(box, tile)
+            elif event == 'error':
+                print(f"实时预览失败: {str(data)}")
         
     def convert_text(self):
         text = self.text_input.get("1.0", tk.END)  # 移除.strip()保留所有空格
         if not text.strip():  # 只检查是否全是空白
             messagebox.showwarning("警告", "请输入要转换的文字！")
             return
+        if self.convert_job is not None:
+            return
             
         # 创建进度条窗口
         progress_window = tk.Toplevel(self.root)
@@ -459,94 +569,77 @@ class HandwritingConverter:
                                 style="Custom.TLabel")
         progress_label.grid(row=0, column=0, sticky=tk.W, pady=(0, 20))
         
-        progress_var = tk.DoubleVar()
+        self.progress_var = tk.DoubleVar()
         progress_bar = ttk.Progressbar(progress_frame,
                                     length=200,
                                     mode='determinate',
-                                    variable=progress_var)
+                                    variable=self.progress_var)
         progress_bar.grid(row=1, column=0, sticky=(tk.W, tk.E), pady=(0, 20))
         
-        def update_progress(value):
-            progress_var.set(value)
-            progress_window.update()
-            
-        try:
-            if self.background['current']:
-                try:
-                    bg_img = Image.open(self.background['current'])
-                    output_width, output_height = bg_img.size
-                    if bg_img.mode == 'RGBA':
-                        img = Image.new('RGBA', (output_width, output_height), color=self.background['color'])
-                        img = Image.alpha_composite(img, bg_img)
-                    else:
-                        img = bg_img.copy()
-                except Exception as e:
-                    print(f"背景图片加载失败: {str(e)}")
-                    output_width = output_height = 1000
-                    img = Image.new('RGB', (output_width, output_height), color=self.background['color'])
-            else:
-                output_width = output_height = 1000
-                img = Image.new('RGB', (output_width, output_height), color=self.background['color'])
-            
-            update_progress(10)
-            
-            draw = ImageDraw.Draw(img)
-            font = self.get_font('handwriting', self.font_size)
-            update_progress(40)
-            
-            # 计算文本高度
-            test_bbox = draw.textbbox((0, 0), "测试", font=font)
-            text_height = test_bbox[3] - test_bbox[1]
-            
-            # 计算可用区域
-            available_width = output_width - self.margins['left'] - self.margins['right']
-            available_height = output_height - self.margins['top'] - self.margins['bottom']
-            
-            # 设置文本颜色和透明度
-            text_color = self.text_color_settings['color']
-            opacity = int(self.text_color_settings['opacity'] * 255)
-            
-            # 处理文本
-            self.process_text(draw, text, font, available_width, available_height, text_height, text_color, opacity)
-            
-            update_progress(80)
-            
-            # 保存图片
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = os.path.join(self.output_dir, f'handwriting_{timestamp}.png')
-            img.save(filename)
-            update_progress(100)
+        # 关闭进度窗口即取消转换
+        def on_closing():
+            if self.convert_job is not None:
+                self.convert_job.cancel()
+                self.convert_job = None
+            self.close_progress_window()
             
-            progress_window.destroy()
-            messagebox.showinfo("成功", f"手写体图片已保存至：{filename}")
+        progress_window.protocol("WM_DELETE_WINDOW", on_closing)
+        self.progress_window = progress_window
+        
+        # 在后台线程中渲染和保存
+        self.convert_job = self.render_worker.submit('convert', self.render_convert, text, self.get_settings())
+        
+    def render_convert(self, job, progress, text, settings):
+        """在后台线程中渲染所有页面并保存，返回(文件列表, 第一页的预览图)"""
+        self.renderer.update_settings(settings)
+        profiler = self.renderer.profiler
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        encoder = get_encoder(settings)
+        
+        def get_filename(index, count):
+            # 文字超过一页时按页编号，PDF保存为一个文件
+            return encoder.get_filename(os.path.join(self.output_dir, f'handwriting_{timestamp}'), index, count)
             
-            # 更新预览
-            self.preview_area.delete("all")
-            # 计算预览区域的最大尺寸
-            max_preview_size = 800  # 预览区域的最大尺寸
-            # 计算缩放比例，保持原始比例
-            ratio = min(max_preview_size/output_width, max_preview_size/output_height)
-            preview_width = int(output_width * ratio)
-            preview_height = int(output_height * ratio)
-            # 调整图片大小，保持原始比例
-            preview_img = img.resize((preview_width, preview_height), Image.Resampling.LANCZOS)
-            photo = ImageTk.PhotoImage(preview_img)
-            # 创建图片，保持原始比例
-            self.preview_area.create_image(0, 0, image=photo, anchor="nw")
-            self.preview_area.image = photo
-            # 设置滚动区域
-            self.preview_area.configure(scrollregion=self.preview_area.bbox("all"))
-            # 设置预览区域大小
-            self.preview_area.configure(width=max_preview_size, height=max_preview_size)
+        with profiler.record('convert'):
+            cache_key = None
+            if self.output_cache is not None:
+                cache_key = self.output_cache.get_key(self.renderer, text, encoder.get_key())
+                filenames = self.output_cache.restore(cache_key, get_filename)
+                if filenames:
+                    profiler.count('output_cache_hits')
+                    preview_img = self.renderer.render_preview(text)
+                    progress(100)
+                    return filenames, preview_img
+                    
+            pages = self.renderer.render_pages(text)
+            progress(20)
             
-        except Exception as e:
-            print(f"转换文字失败: {str(e)}")
-            messagebox.showerror("错误", f"转换文字失败: {str(e)}")
-            progress_window.destroy()
+            # 渲染并保存图片，页数较多时分给多个进程，编码在后台线程中进行
+            page_filenames = [get_filename(index, len(pages)) for index in range(len(pages))]
+            for done, _ in enumerate(save_pages(self.renderer, settings, pages, page_filenames,
+                                                encoder=encoder), 1):
+                job.check_cancelled()
+                progress(20 + 80 * done / len(pages))
+            filenames = list(dict.fromkeys(page_filenames))
+            stats = encoder.stats()
+            print(f"编码{stats['pages']}页{stats['format']}，耗时{stats['encode_ms'] / 1000:.2f}秒，"
+                  f"共{stats['encoded_bytes'] / 1024 / 1024:.2f}MB")
+            # 使用刚才的排版结果，没有设置seed时预览也与保存的图片一致
+            preview_img = self.renderer.render_preview(text, plan=pages.plan)
+                
+            if self.output_cache is not None:
+                self.output_cache.put(cache_key, filenames)
+        return filenames, preview_img
+        
+    def close_progress_window(self):
+        if self.progress_window is not None:
+            self.progress_window.destroy()
+            self.progress_window = None
         
     def clear_text(self):
         self.text_input.delete("1.0", tk.END)
         self.preview_area.delete("all")
+        self.reset_live_preview()
                                     
     def init_fonts(self):
         """初始化字体设置"""
@@ -556,28 +649,13 @@ class HandwritingConverter:
         }
         
         # 检查fonts文件夹中的字体文件
-        font_files = [f for f in os.listdir(self.fonts_dir) if f.endswith(('.ttf', '.ttc', '.otf'))]
+        font_files = self.asset_catalog.font_names()
         if font_files:
             # 如果找到字体文件，使用第一个作为手写体字体
             self.fonts['handwriting'] = os.path.join(self.fonts_dir, font_files[0])
         else:
             messagebox.showinfo("提示", "请在fonts文件夹中添加字体文件(.ttf/.ttc/.otf)")
             
-    def get_font(self, font_type='default', size=36):
-        """获取指定类型的字体"""
-        try:
-            if font_type == 'handwriting' and self.fonts['handwriting']:
-                if os.path.exists(self.fonts['handwriting']):
-                    return ImageFont.truetype(self.fonts['handwriting'], size)
-                else:
-                    print(f"手写体字体文件不存在: {self.fonts['handwriting']}")
-                    return ImageFont.truetype(self.fonts['default'], size)
-            else:
-                return ImageFont.truetype(self.fonts['default'], size)
-        except Exception as e:
-            print(f"加载字体失败: {str(e)}")
-            return ImageFont.load_default()
-            
     def init_background(self):
         """初始化背景设置"""
         self.background = {
@@ -586,7 +664,7 @@ class HandwritingConverter:
         }
         
         # 检查background文件夹中的背景图片
-        bg_files = [f for f in os.listdir(self.background_dir) if f.endswith(('.png', '.jpg', '.jpeg'))]
+        bg_files = self.asset_catalog.background_names()
         if bg_files:
             self.background['current'] = os.path.join(self.background_dir, bg_files[0])
         else:
@@ -609,6 +687,7 @@ class HandwritingConverter:
     def init_chaos_level(self):
         """初始化字体混乱度设置"""
         self.chaos_level = 5  # 默认混乱度为5（范围1-10）
+        self.seed = None  # 随机种子，None表示每次随机
         
     def init_margins(self):
         """初始化边距设置"""
@@ -619,77 +698,48 @@ class HandwritingConverter:
             'bottom': 50   # 下边距
         }
         
-    def get_random_offset(self, chaos_level):
-        """根据混乱度获取随机偏移量"""
-        # 混乱度越高，偏移范围越大
-        max_offset = chaos_level * 2
-        return random.randint(-max_offset, max_offset)
-        
     def generate_preview_image(self):
         text = self.text_input.get("1.0", tk.END)  # 移除.strip()保留所有空格
         if not text.strip():  # 只检查是否全是空白
             messagebox.showwarning("警告", "请先输入要转换的文字！")
             return
             
-        try:
-            # 如果有背景图片，使用背景图片的尺寸，否则使用默认尺寸
-            if self.background['current']:
-                try:
-                    bg_img = Image.open(self.background['current'])
-                    output_width, output_height = bg_img.size
-                    if bg_img.mode == 'RGBA':
-                        img = Image.new('RGBA', (output_width, output_height), color=self.background['color'])
-                        img = Image.alpha_composite(img, bg_img)
-                    else:
-                        img = bg_img.copy()
-                except Exception as e:
-                    print(f"背景图片加载失败: {str(e)}")
-                    output_width = output_height = 1000
-                    img = Image.new('RGB', (output_width, output_height), color=self.background['color'])
-            else:
-                output_width = output_height = 1000
-                img = Image.new('RGB', (output_width, output_height), color=self.background['color'])
-                    
-            draw = ImageDraw.Draw(img)
-            font = self.get_font('handwriting', self.font_size)
-            
-            # 计算文本高度
-            test_bbox = draw.textbbox((0, 0), "测试", font=font)
-            text_height = test_bbox[3] - test_bbox[1]
-            
-            # 计算可用区域
-            available_width = output_width - self.margins['left'] - self.margins['right']
-            available_height = output_height - self.margins['top'] - self.margins['bottom']
-            
-            # 设置文本颜色和透明度
-            text_color = self.text_color_settings['color']
-            opacity = int(self.text_color_settings['opacity'] * 255)
-            
-            # 处理文本
-            self.process_text(draw, text, font, available_width, available_height, text_height, text_color, opacity)
-            
-            # 显示预览
-            self.preview_area.delete("all")
-            # 计算预览区域的最大尺寸
-            max_preview_size = 800  # 预览区域的最大尺寸
-            # 计算缩放比例，保持原始比例
-            ratio = min(max_preview_size/output_width, max_preview_size/output_height)
-            preview_width = int(output_width * ratio)
-            preview_height = int(output_height * ratio)
-            # 调整图片大小，保持原始比例
-            preview_img = img.resize((preview_width, preview_height), Image.Resampling.LANCZOS)
-            photo = ImageTk.PhotoImage(preview_img)
-            # 创建图片，保持原始比例
-            self.preview_area.create_image(0, 0, image=photo, anchor="nw")
-            self.preview_area.image = photo
-            # 设置滚动区域
-            self.preview_area.configure(scrollregion=self.preview_area.bbox("all"))
-            # 设置预览区域大小
-            self.preview_area.configure(width=max_preview_size, height=max_preview_size)
-            
-        except Exception as e:
-            print(f"生成预览图片失败: {str(e)}")
-            messagebox.showerror("错误", f"生成预览图片失败: {str(e)}")
+        # 之前的预览任务已经过时
+        self.render_worker.cancel('preview')
+        self.render_worker.submit('preview', self.render_preview, text, self.get_settings())
+        
+    def render_preview(self, job, progress, text, settings):
+        """在后台线程中直接以预览尺寸渲染第一页"""
+        self.renderer.update_settings(settings)
+        return self.renderer.render_preview(text)
+
+    def show_preview_image(self, preview_img):
+        """显示已经缩放到预览尺寸的图片，图片之后归界面线程所有，局部更新会贴到它上面"""
+        max_preview_size = 800  # 预览区域的最大尺寸
+        self.preview_area.delete("all")
+        self.preview_tiles = []
+        self.shown_preview_img = preview_img
+        photo = ImageTk.PhotoImage(preview_img)
+        # 创建图片，保持原始比例
+        self.preview_area.create_image(0, 0, image=photo, anchor="nw")
+        self.preview_area.image = photo
+        # 设置滚动区域
+        self.preview_area.configure(scrollregion=self.preview_area.bbox("all"))
+        # 设置预览区域大小
+        self.preview_area.configure(width=max_preview_size, height=max_preview_size)
+        
+    def show_preview_tile(self, box, tile):
+        """只更新预览中的一块区域"""
+        # 后台线程中的预览图随时可能被修改，界面线程只使用自己保存的副本
+        if self.shown_preview_img is not None:
+            self.shown_preview_img.paste(tile, box[:2])
+            if len(self.preview_tiles) >= 50:
+                # 局部更新过多时合并为一整张图片
+                self.show_preview_image(self.shown_preview_img)
+                return
+        photo = ImageTk.PhotoImage(tile)
+        self.preview_area.create_image(box[0], box[1], image=photo, anchor="nw")
+        self.preview_tiles.append(photo)
 
     def show_settings(self):
         """显示设置对话框"""
@@ -732,7 +782,9 @@ class HandwritingConverter:
         
         # 字体选择下拉框
         font_var = tk.StringVar()
-        font_files = [f for f in os.listdir(self.fonts_dir) if f.endswith(('.ttf', '.ttc', '.otf'))]
+        # 打开设置窗口时检查是否有新添加的字体和背景
+        self.asset_catalog.refresh()
+        font_files = self.asset_catalog.font_names()
         if not font_files:
             font_files = ["默认字体"]
         # 设置当前选中的字体
@@ -745,12 +797,17 @@ class HandwritingConverter:
         else:
             font_var.set("默认字体")
         
-        font_combo = ttk.Combobox(settings_frame,
+        font_frame = ttk.Frame(settings_frame, style="Custom.TFrame")
+        font_frame.grid(row=1, column=0, sticky=tk.W, pady=(0, 20))
+        font_combo = ttk.Combobox(font_frame,
                                 textvariable=font_var,
                                 values=font_files,
                                 state="readonly",
                                 width=30)
-        font_combo.grid(row=1, column=0, sticky=tk.W, pady=(0, 20))
+        font_combo.grid(row=0, column=0, sticky=tk.W)
+        # 字体示例
+        font_sample_label = ttk.Label(font_frame, style="Custom.TLabel")
+        font_sample_label.grid(row=1, column=0, sticky=tk.W, pady=(5, 0))
         
         # 字体大小设置
         size_label = ttk.Label(settings_frame,
@@ -911,6 +968,7 @@ class HandwritingConverter:
                 # 自动保存颜色设置
                 self.text_color_settings['color'] = color
                 self.save_settings()
+                self.on_settings_change()
         
         color_button = RoundedButton(color_frame,
                                    text="选择颜色",
@@ -942,7 +1000,7 @@ class HandwritingConverter:
         
         # 背景选择下拉框
         bg_var = tk.StringVar()
-        bg_files = [f for f in os.listdir(self.background_dir) if f.endswith(('.png', '.jpg', '.jpeg'))]
+        bg_files = self.asset_catalog.background_names()
         bg_files.insert(0, "纯色背景")
         # 设置当前选中的背景
         if self.background['current']:
@@ -954,15 +1012,55 @@ class HandwritingConverter:
         else:
             bg_var.set("纯色背景")
         
-        bg_combo = ttk.Combobox(settings_frame,
+        bg_frame = ttk.Frame(settings_frame, style="Custom.TFrame")
+        bg_frame.grid(row=20, column=0, sticky=tk.W, pady=(0, 20))
+        bg_combo = ttk.Combobox(bg_frame,
                               textvariable=bg_var,
                               values=bg_files,
                               state="readonly",
                               width=30)
-        bg_combo.grid(row=20, column=0, sticky=tk.W, pady=(0, 20))
+        bg_combo.grid(row=0, column=0, sticky=tk.W)
+        # 背景缩略图
+        bg_thumbnail_label = ttk.Label(bg_frame, style="Custom.TLabel")
+        bg_thumbnail_label.grid(row=1, column=0, sticky=tk.W, pady=(5, 0))
+        
+        # 随机种子设置
+        seed_label = ttk.Label(settings_frame,
+                             text="随机种子（留空则每次随机）",
+                             font=('微软雅黑', 12, 'bold'),
+                             style="Custom.TLabel")
+        seed_label.grid(row=21, column=0, sticky=tk.W, pady=(0, 10))
+        
+        seed_var = tk.StringVar(value='' if self.seed is None else str(self.seed))
+        seed_entry = ttk.Entry(settings_frame,
+                             textvariable=seed_var,
+                             width=10)
+        seed_entry.grid(row=22, column=0, sticky=tk.W, pady=(0, 20))
+        
+        # 输出格式设置
+        output_label = ttk.Label(settings_frame,
+                               text="输出格式",
+                               font=('微软雅黑', 12, 'bold'),
+                               style="Custom.TLabel")
+        output_label.grid(row=23, column=0, sticky=tk.W, pady=(0, 10))
+        
+        output_formats = [name for name in ENCODERS if name != 'jpg']
+        output_settings = getattr(self, 'output_settings', None) or {}
+        output_var = tk.StringVar(value=str(output_settings.get('format', 'png')).lower())
+        output_combo = ttk.Combobox(settings_frame,
+                                  textvariable=output_var,
+                                  values=output_formats,
+                                  state="readonly",
+                                  width=10)
+        output_combo.grid(row=24, column=0, sticky=tk.W, pady=(0, 20))
+        
+        # 正在把外部修改的设置显示到窗口中时不自动保存
+        refreshing = []
         
         # 自动保存函数
         def auto_save(*args):
+            if refreshing:
+                return
             try:
                 # 更新字体设置
                 if font_var.get() != "默认字体":
@@ -995,12 +1093,76 @@ class HandwritingConverter:
                 else:
                     self.background['current'] = None
                 
+                # 更新随机种子
+                self.seed = int(seed_var.get()) if seed_var.get().strip() else None
+                
+                # 更新输出格式，其他编码选项只能手动写入settings.json，原样保留
+                self.output_settings = dict(getattr(self, 'output_settings', None) or {}, format=output_var.get())
+                
                 # 保存设置到文件
                 self.save_settings()
+                self.on_settings_change()
             except ValueError:
                 pass
         
+        # 显示字体示例和背景缩略图，没有缓存时在后台生成，生成后再显示
+        thumbnail_photos = {}
+        
+        def show_thumbnail(label, kind, path):
+            img = self.thumbnail_cache.get(kind, path) if path else None
+            if img is None:
+                thumbnail_photos.pop(kind, None)
+                label.configure(image='', text="正在生成预览..." if path else "")
+                return
+            photo = ImageTk.PhotoImage(img)
+            thumbnail_photos[kind] = photo
+            label.configure(image=photo, text="")
+            
+        def update_thumbnails(*args):
+            font_name = font_var.get()
+            font_path = os.path.join(self.fonts_dir, font_name) if font_name != "默认字体" else None
+            show_thumbnail(font_sample_label, 'font', font_path)
+            bg_name = bg_var.get()
+            bg_path = os.path.join(self.background_dir, bg_name) if bg_name != "纯色背景" else None
+            show_thumbnail(bg_thumbnail_label, 'background', bg_path)
+            
+        def poll_thumbnails():
+            if not settings_window.winfo_exists():
+                return
+            if self.thumbnail_cache.poll():
+                update_thumbnails()
+            settings_window.after(100, poll_thumbnails)
+            
+        def prefetch_visible(kind, combo, names, directory):
+            # 素材很多时只预先生成下拉列表中当前选项附近能看到的几项
+            height = int(combo.cget('height'))
+            try:
+                index = names.index(combo.get())
+            except ValueError:
+                index = 0
+            start = max(0, index - height // 2)
+            self.thumbnail_cache.prefetch(kind, [os.path.join(directory, name) for name in names[start:start + height]
+                                                 if name not in ("默认字体", "纯色背景")])
+            
+        def prefetch_fonts(*args):
+            prefetch_visible('font', font_combo, font_files, self.fonts_dir)
+            
+        def prefetch_backgrounds(*args):
+            prefetch_visible('background', bg_combo, bg_files, self.background_dir)
+            
+        # 当前选中的优先生成，附近的几项在后台依次生成
+        update_thumbnails()
+        prefetch_fonts()
+        prefetch_backgrounds()
+        font_combo.configure(postcommand=prefetch_fonts)
+        bg_combo.configure(postcommand=prefetch_backgrounds)
+        poll_thumbnails()
+        
         # 绑定变量跟踪
+        font_var.trace_add("write", update_thumbnails)
+        bg_var.trace_add("write", update_thumbnails)
+        font_var.trace_add("write", prefetch_fonts)
+        bg_var.trace_add("write", prefetch_backgrounds)
         font_var.trace_add("write", auto_save)
         size_var.trace_add("write", auto_save)
         h_spacing_var.trace_add("write", auto_save)
@@ -1012,6 +1174,40 @@ class HandwritingConverter:
         bottom_margin_var.trace_add("write", auto_save)
         opacity_var.trace_add("write", auto_save)
         bg_var.trace_add("write", auto_save)
+        seed_var.trace_add("write", auto_save)
+        output_var.trace_add("write", auto_save)
+        
+        # settings.json被其他程序修改并应用后，重新显示当前的设置
+        def refresh_variables():
+            if not settings_window.winfo_exists():
+                return
+            refreshing.append(True)
+            try:
+                if self.fonts['handwriting']:
+                    current_font = os.path.basename(self.fonts['handwriting'])
+                    if current_font in font_files:
+                        font_var.set(current_font)
+                else:
+                    font_var.set("默认字体")
+                size_var.set(str(self.font_size))
+                h_spacing_var.set(str(self.text_spacing['horizontal']))
+                v_spacing_var.set(str(self.text_spacing['vertical']))
+                chaos_var.set(self.chaos_level)
+                left_margin_var.set(str(self.margins['left']))
+                right_margin_var.set(str(self.margins['right']))
+                top_margin_var.set(str(self.margins['top']))
+                bottom_margin_var.set(str(self.margins['bottom']))
+                color_var.set(self.text_color_settings['color'])
+                color_preview.configure(bg=self.text_color_settings['color'])
+                opacity_var.set(str(self.text_color_settings['opacity']))
+                current_bg = os.path.basename(self.background['current']) if self.background['current'] else None
+                bg_var.set(current_bg if current_bg in bg_files else "纯色背景")
+                seed_var.set('' if self.seed is None else str(self.seed))
+                output_var.set(str((self.output_settings or {}).get('format', 'png')).lower())
+            finally:
+                refreshing.clear()
+                
+        self.refresh_settings_dialog = refresh_variables
         
         # 配置网格权重
         settings_window.grid_rowconfigure(0, weight=1)
@@ -1035,6 +1231,7 @@ class HandwritingConverter:
         # 绑定窗口关闭事件，解除鼠标滚轮绑定
         def on_closing():
             canvas.unbind_all("<MouseWheel>")
+            self.refresh_settings_dialog = None
             settings_window.destroy()
             
         settings_window.protocol("WM_DELETE_WINDOW", on_closing)
@@ -0,0 +1,566 @@
+from PIL import ImageColor, ImageFont
+from render_cache import LRUCache, glyph_cache, variant_cache, font_cache, background_cache
+from layout_plan import LayoutPlan, PagePlan
+from render_profiler import RenderProfiler
+from font_metrics import metrics_store
+from font_fallback import FontChain, coverage_store
+from asset_catalog import AssetCatalog
+from array import array
+import hashlib
+import itertools
+import os
+import random
+import json
+import copy
+
+try:
+    import numpy as np
+except ImportError:
+    # 没有安装numpy时使用random模块生成随机偏移
+    np = None
+
+# 默认设置，与settings.json的结构保持一致
+DEFAULT_SETTINGS = {
+    'font_size': 36,
+    'text_color': '#000000',
+    'text_opacity': 1.0,
+    'text_spacing': {
+        'horizontal': 0,
+        'vertical': 10
+    },
+    'chaos_level': 5,
+    # 每个字形预先生成的变体数量，同一个字多次出现时随机选用，1表示不使用变体
+    'glyph_variants': 4,
+    # 随机种子，设置后相同的文本和设置总是得到相同的图片，None表示每次随机
+    'seed': None,
+    'margins': {
+        'left': 50,
+        'right': 50,
+        'top': 50,
+        'bottom': 50
+    },
+    'background': {
+        'current': None,
+        'color': '#faf9de'
+    },
+    # 手写体缺字时依次使用的字体（fonts文件夹中的文件名），None表示fonts文件夹中的其他所有字体
+    'fallback_fonts': None
+}
+
+# 定义标点符号列表
+PUNCTUATION = '，。！？、；：""''（）《》【】…—'
+
+
+def merge_settings(settings, overrides):
+    """返回合并后的新设置，overrides中的项覆盖settings，嵌套的字典逐项合并"""
+    merged = copy.deepcopy(settings)
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key].update(value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def load_settings(path='settings.json'):
+    """从文件加载设置，缺失的项使用默认值"""
+    settings = copy.deepcopy(DEFAULT_SETTINGS)
+    try:
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            settings = merge_settings(settings, saved)
+    except Exception as e:
+        print(f"加载设置失败: {str(e)}")
+    return settings
+
+
+class HandwritingRenderer:
+    """手写体渲染引擎，不依赖tkinter，可在无界面的环境中使用"""
+
+    def __init__(self, settings=None, fonts_dir='fonts', default_font='msyh.ttc',
+                 glyph_cache=glyph_cache, variant_cache=variant_cache, font_cache=font_cache,
+                 background_cache=background_cache,
+                 metrics_store=metrics_store, coverage_store=coverage_store, asset_catalog=None):
+        self.fonts_dir = fonts_dir
+        # 字体文件夹的目录，回退链从中取得字体列表和字符范围；没有传入时读取磁盘上保存的目录并检查一次文件夹
+        if asset_catalog is None:
+            # 渲染只需要字体的信息，不读取背景文件夹
+            asset_catalog = AssetCatalog(fonts_dir, None)
+            asset_catalog.refresh()
+        self.asset_catalog = asset_catalog
+        self.default_font = default_font
+        self.glyph_cache = glyph_cache
+        self.variant_cache = variant_cache
+        self.font_cache = font_cache
+        self.background_cache = background_cache
+        self.metrics_store = metrics_store
+        self.coverage_store = coverage_store
+        # 每种字体和字号的回退链
+        self.chain_cache = LRUCache(max_size=16)
+        # 排版结果缓存，只修改颜色、透明度或背景时无需重新排版
+        self.plan_cache = LRUCache(max_size=8)
+        # 分阶段耗时统计，默认关闭
+        self.profiler = RenderProfiler.from_env(caches={
+            'glyph_cache': glyph_cache,
+            'variant_cache': variant_cache,
+            'font_cache': font_cache,
+            'background_cache': background_cache
+        })
+        self.seed = None
+        self.rng = self.create_rng()
+        self.update_settings(settings if settings is not None else DEFAULT_SETTINGS)
+
+    def update_settings(self, settings):
+        """应用一份设置（结构与settings.json相同）"""
+        self.font_size = int(settings.get('font_size', DEFAULT_SETTINGS['font_size']))
+        self.text_color = settings.get('text_color', DEFAULT_SETTINGS['text_color'])
+        self.text_opacity = float(settings.get('text_opacity', DEFAULT_SETTINGS['text_opacity']))
+
+        spacing_settings = settings.get('text_spacing', {})
+        self.text_spacing = {
+            'horizontal': int(spacing_settings.get('horizontal', 0)),
+            'vertical': int(spacing_settings.get('vertical', 10))
+        }
+
+        self.chaos_level = int(settings.get('chaos_level', DEFAULT_SETTINGS['chaos_level']))
+        self.glyph_variants = max(1, min(255, int(settings.get('glyph_variants', DEFAULT_SETTINGS['glyph_variants']))))
+
+        seed = settings.get('seed')
+        seed = int(seed) if seed is not None else None
+        if seed != self.seed:
+            self.seed = seed
+            self.rng = self.create_rng()
+
+        margins_settings = settings.get('margins', {})
+        self.margins = {
+            'left': int(margins_settings.get('left', 50)),
+            'right': int(margins_settings.get('right', 50)),
+            'top': int(margins_settings.get('top', 50)),
+            'bottom': int(margins_settings.get('bottom', 50))
+        }
+
+        bg_settings = settings.get('background', {})
+        self.background = {
+            'current': bg_settings.get('current'),
+            'color': bg_settings.get('color', '#faf9de')
+        }
+
+        self.profiler.configure(settings.get('profile'))
+
+        # 手写体字体只保存文件名，相对于字体文件夹
+        self.handwriting_font = None
+        if settings.get('handwriting_font'):
+            self.handwriting_font = os.path.join(self.fonts_dir, settings['handwriting_font'])
+
+        self.fallback_fonts = settings.get('fallback_fonts')
+        self.fallback_paths = self.get_fallback_paths()
+
+    def get_font(self, size=None):
+        """获取手写体字体，加载失败时回退到默认字体，加载过的字体会被缓存"""
+        if size is None:
+            size = self.font_size
+        with self.profiler.stage('font'):
+            try:
+                if self.handwriting_font:
+                    if os.path.exists(self.handwriting_font):
+                        return self.font_cache.get_font(self.handwriting_font, size)
+                    else:
+                        print(f"手写体字体文件不存在: {self.handwriting_font}")
+                return self.font_cache.get_font(self.default_font, size)
+            except Exception as e:
+                print(f"加载字体失败: {str(e)}")
+                return ImageFont.load_default()
+
+    def get_fallback_paths(self):
+        """缺字时依次尝试的字体文件，最后是默认字体"""
+        names = self.fallback_fonts
+        if names is None:
+            names = self.asset_catalog.font_names()
+        paths = [os.path.join(self.fonts_dir, name) for name in names] + [self.default_font]
+        return [path for index, path in enumerate(paths)
+                if path != self.handwriting_font and path not in paths[:index]]
+
+    def get_font_chain(self, font):
+        """取得字体的回退链，按字体和回退字体列表缓存"""
+        key = (id(font), self.get_font_key(font), tuple(self.fallback_paths))
+        chain = self.chain_cache.get(key)
+        if chain is None:
+            size = getattr(font, 'size', self.font_size)
+            chain = FontChain(font, self.fallback_paths, lambda path: self.font_cache.get_font(path, size),
+                              self.metrics_store, self.asset_catalog, self.coverage_store)
+            self.chain_cache.put(key, chain)
+        return chain
+
+    def clear_caches(self):
+        """清空渲染用到的所有进程内缓存，下一次渲染相当于刚启动的进程（磁盘上的字符尺寸表和素材目录仍然保留）"""
+        for cache in (self.glyph_cache, self.variant_cache, self.font_cache, self.background_cache,
+                      self.metrics_store, self.coverage_store, self.chain_cache, self.plan_cache):
+            cache.clear()
+        self.asset_catalog.clear_cache()
+
+    def get_base_page(self):
+        """获取缓存的底图，有背景图片时使用背景图片的尺寸，否则使用默认尺寸。返回的图片不可修改"""
+        with self.profiler.stage('background'):
+            if self.background['current']:
+                try:
+                    return self.background_cache.get_base(self.background['current'], self.background['color'])
+                except Exception as e:
+                    print(f"背景图片加载失败: {str(e)}")
+            return self.background_cache.get_base(None, self.background['color'])
+
+    def get_page_size(self):
+        """页面尺寸，与get_base_page()的尺寸相同，但只读取背景图片的文件头"""
+        if self.background['current']:
+            try:
+                return self.background_cache.get_size(self.background['current'])
+            except Exception as e:
+                print(f"背景图片加载失败: {str(e)}")
+        return self.background_cache.get_size(None)
+
+    def get_preview_base(self, max_preview_size=800):
+        """获取缩小到预览尺寸的底图"""
+        with self.profiler.stage('background'):
+            if self.background['current']:
+                try:
+                    return self.background_cache.get_preview_base(self.background['current'],
+                                                                  self.background['color'], max_preview_size)
+                except Exception as e:
+                    print(f"背景图片加载失败: {str(e)}")
+            return self.background_cache.get_preview_base(None, self.background['color'], max_preview_size)
+
+    def create_canvas(self):
+        """创建一张新的画布"""
+        return self.get_base_page().copy()
+
+    def render(self, text):
+        """将文本渲染为手写体图片，只返回第一页"""
+        with self.profiler.record('render'):
+            return self.render_pages(text)[0]
+
+    def render_preview(self, text, page_index=0, max_preview_size=800, plan=None):
+        """
+        直接以预览尺寸渲染一页：排版仍按原尺寸进行，保证换行和分页与生成的图片一致，
+        只把字号、位置（含边距和间距）按比例缩小后贴到缩小的底图上。
+        传入已有的排版结果时直接使用，预览与生成的图片完全一致
+        """
+        with self.profiler.record('render_preview'):
+            if plan is None:
+                page_size = self.get_page_size()
+                font = self.get_font()
+                plan = self.layout(text, font, page_size)
+            else:
+                page_size = plan.page_size
+                font = self.get_plan_font(plan)
+            base = self.get_preview_base(max_preview_size)
+            scale = base.width / page_size[0]
+            preview_font = self.get_font(max(1, round(getattr(font, 'size', self.font_size) * scale)))
+            page = plan[min(page_index, len(plan) - 1)]
+            with self.profiler.stage('raster'):
+                img = base.copy()
+                self.paste_glyphs(img, ((char, x * scale, y * scale) for char, x, y in page), preview_font,
+                                  self.text_color, int(self.text_opacity * 255), variants=page.variants)
+            self.profiler.count('glyphs', len(page))
+            return img
+
+    def render_pages(self, text, plan=None):
+        """对整段文本分页排版，返回按需渲染的页面序列。可以传入已保存的排版结果直接渲染"""
+        base = self.get_base_page()
+        if plan is None:
+            font = self.get_font()
+            plan = self.layout(text, font, base.size)
+        else:
+            font = self.get_plan_font(plan)
+
+        # 设置文本颜色和透明度
+        opacity = int(self.text_opacity * 255)
+        return PageSequence(self, plan, base, font, self.text_color, opacity)
+
+    def get_font_key(self, font):
+        """字体的(路径, 字号)，内置字体没有路径"""
+        path = getattr(font, 'path', None)
+        return (path if isinstance(path, str) else None, getattr(font, 'size', self.font_size))
+
+    def get_plan_font(self, plan):
+        """取得排版结果所使用的字体"""
+        return self.get_font_by_key(plan.font_key)
+
+    def get_font_by_key(self, font_key):
+        """按get_font_key()返回的(路径, 字号)取得字体"""
+        path, size = font_key
+        if path:
+            try:
+                return self.font_cache.get_font(path, size)
+            except Exception as e:
+                print(f"加载字体失败: {str(e)}")
+        return self.get_font(size)
+
+    def get_layout_key(self, text, font, page_size):
+        """影响排版的所有因素，颜色、透明度和背景图案不影响排版"""
+        return (
+            hashlib.sha1(text.encode('utf-8')).hexdigest(),
+            self.get_font_key(font),
+            tuple(self.fallback_paths),
+            tuple(page_size),
+            self.text_spacing['horizontal'],
+            self.text_spacing['vertical'],
+            self.chaos_level,
+            self.get_variant_count(),
+            self.seed,
+            tuple(self.margins[side] for side in ('left', 'right', 'top', 'bottom'))
+        )
+
+    def layout(self, text, font, page_size):
+        """获取文本的排版结果，设置了seed时相同文本和排版设置直接复用缓存"""
+        if self.seed is None:
+            # 没有设置seed时每次排版的随机偏移都不同，不能复用
+            with self.profiler.stage('layout'):
+                return self.process_text(text, font, page_size)
+        key = self.get_layout_key(text, font, page_size)
+        plan = self.plan_cache.get(key)
+        if plan is None:
+            with self.profiler.stage('layout'):
+                plan = self.process_text(text, font, page_size)
+            self.plan_cache.put(key, plan)
+        return plan
+
+    def get_line_metrics(self, font, page_size):
+        """计算排版需要的尺寸：行高、换行位置、可用高度和空格宽度"""
+        output_width, output_height = page_size
+
+        # 计算文本高度
+        test_bbox = font.getbbox("测试")
+        text_height = test_bbox[3] - test_bbox[1]
+
+        # 计算可用区域
+        available_width = output_width - self.margins['left'] - self.margins['right']
+        available_height = output_height - self.margins['top'] - self.margins['bottom']
+
+        # 字符宽度从尺寸表中查询，不再每次调用FreeType；手写体缺字时按回退字体测量
+        font_chain = self.get_font_chain(font)
+        font_metrics = font_chain.metrics
+
+        # 使用一个字符的1/4宽度作为空格宽度
+        space_width = font_metrics.width("字") * 0.25  # 缩小为1/4宽度
+
+        return {
+            'font_metrics': font_metrics,
+            'font_chain': font_chain,
+            'line_height': text_height + self.text_spacing['vertical'],
+            'line_limit': available_width - self.margins['right'],
+            'available_height': available_height,
+            'space_width': space_width
+        }
+
+    def break_paragraph(self, paragraph, font, metrics):
+        """把一段文字折成若干行，返回[[(字符, x), ...], ...]"""
+        return list(self.iter_lines([paragraph], font, metrics))
+
+    def iter_lines(self, chunks, font, metrics):
+        """
+        流式折行：chunks为文本片段的迭代器，每行写满或遇到换行时立即返回该行[(字符, x), ...]，
+        不需要等整段读完，很长的段落也只保留当前一行。每段至少一行，结果与逐段调用break_paragraph()相同
+        """
+        line = []
+        x = left = self.margins['left']
+        char_width_of = metrics['font_chain'].width
+
+        # 遍历每个字符
+        for chunk in chunks:
+            for char in chunk:
+                if char == '\n':
+                    # 段落结束，下一段从新的一行开始
+                    yield line
+                    line = []
+                    x = left
+                    continue
+
+                # 获取字符宽度
+                if char == ' ':
+                    # 如果是空格，不绘制任何内容，只移动x坐标
+                    x += metrics['space_width'] + self.text_spacing['horizontal']
+                    continue
+
+                # 获取字符的实际宽度
+                char_width = char_width_of(char)
+
+                # 如果是标点符号，减小占位宽度
+                if char in PUNCTUATION:
+                    char_width = char_width * 0.5  # 标点符号宽度减半
+
+                # 检查是否需要换行
+                if x + char_width > metrics['line_limit']:
+                    yield line
+                    line = []
+                    x = left
+
+                line.append((char, x))
+
+                # 更新x坐标
+                x += char_width + self.text_spacing['horizontal']
+        yield line
+
+    def paginate(self, lines, metrics):
+        """给每一行分配页码和y坐标，超出一页的行排到下一页"""
+        page_index = 0
+        y = self.margins['top']
+        for line in lines:
+            if y > metrics['available_height']:
+                # 当前页已写满，换到下一页
+                page_index += 1
+                y = self.margins['top']
+            yield page_index, y, line
+            # 移动到下一行
+            y += metrics['line_height']
+
+    def process_text(self, text, font, page_size):
+        """排版文本，返回LayoutPlan，超出一页的文字排到下一页"""
+        return LayoutPlan(page_size, self.get_font_key(font), list(self.iter_page_plans([text], font, page_size)))
+
+    def iter_page_plans(self, chunks, font, page_size):
+        """
+        流式排版：chunks为文本片段的迭代器（如逐块读取的文件），每排满一页就返回该页的PagePlan，
+        内存占用与文档长度无关。结果与一次性排版整段文本完全相同
+        """
+        metrics = self.get_line_metrics(font, page_size)
+        # 设置了seed时每次渲染使用相同的随机序列
+        rng = self.create_rng() if self.seed is not None else self.rng
+
+        def make_page(chars, xs, ys):
+            offsets_x, offsets_y, variants = self.get_page_jitter(len(chars), rng)
+            return PagePlan(array('I', map(ord, chars)), array('f', xs), array('f', ys), offsets_x, offsets_y,
+                            variants)
+
+        lines = self.iter_lines(chunks, font, metrics)
+        current_index = 0
+        chars, xs, ys = [], [], []
+        # 只有空行的页面先不返回，后面还有文字时才补上，末尾的空白页直接去掉
+        empty_pages = 0
+        pages_done = 0
+        for page_index, y, line in self.paginate(lines, metrics):
+            if page_index != current_index:
+                if chars:
+                    for _ in range(empty_pages):
+                        yield PagePlan()
+                    yield make_page(chars, xs, ys)
+                    pages_done += empty_pages + 1
+                    empty_pages = 0
+                else:
+                    empty_pages += 1
+                current_index = page_index
+                chars, xs, ys = [], [], []
+            for char, x in line:
+                chars.append(char)
+                xs.append(x)
+                ys.append(y)
+
+        if chars:
+            for _ in range(empty_pages):
+                yield PagePlan()
+            yield make_page(chars, xs, ys)
+        elif not pages_done:
+            # 至少保留一页
+            yield PagePlan()
+
+        # 保存新测量的字符，下次启动时直接读取
+        metrics['font_chain'].save()
+
+    def render_stream(self, chunks):
+        """流式渲染：边读取文本边排版，每排满一页就渲染并返回该页图片"""
+        base = self.get_base_page()
+        font = self.get_font()
+        opacity = int(self.text_opacity * 255)
+        for page in self.iter_page_plans(chunks, font, base.size):
+            yield self.render_page(page, base, font, self.text_color, opacity)
+
+    def render_page(self, page, base, font, text_color, opacity):
+        """按一页的排版结果把字形贴到底图的副本上"""
+        with self.profiler.stage('raster'):
+            img = base.copy()
+            self.paste_glyphs(img, page, font, text_color, opacity, variants=page.variants)
+        self.profiler.count('glyphs', len(page))
+        return img
+
+    def paste_glyphs(self, img, glyphs, font, text_color, opacity, origin=(0, 0), variants=None):
+        """
+        把[(字符, x, y), ...]的字形贴到图片上，origin为图片左上角在页面中的位置，
+        variants为与glyphs一一对应的字形变体序号，None表示全部使用原始字形
+        """
+        ink = ImageColor.getcolor(text_color, img.mode)
+        # 绘制字符，把缓存的字形蒙版贴到画布上
+        for left, top, mask in self.iter_glyph_masks(glyphs, font, text_color, opacity, variants):
+            img.paste(ink, (left - origin[0], top - origin[1]), mask)
+
+    def iter_glyph_masks(self, glyphs, font, text_color, opacity, variants=None):
+        """返回每个字形蒙版在页面中的左上角和蒙版(左, 上, 蒙版)，没有墨迹的字符跳过"""
+        resolve = self.get_font_chain(font).resolve
+        variant_count = self.get_variant_count()
+        if variants is None or variant_count == 1:
+            variants = itertools.repeat(0)
+        for (char, draw_x, draw_y), variant in zip(glyphs, variants):
+            # 手写体缺字时使用回退字体，按基线对齐
+            glyph_font, offset_y, _ = resolve(char)
+            if variant:
+                char_bbox, mask = self.variant_cache.get_variant(glyph_font, char, opacity, self.chaos_level,
+                                                                 variant_count, variant)
+            else:
+                char_bbox, mask = self.glyph_cache.get_glyph(glyph_font, char, text_color, opacity)
+            if mask is not None:
+                yield int(draw_x) + char_bbox[0], int(draw_y) + offset_y + char_bbox[1], mask
+
+    def get_variant_count(self):
+        """实际使用的字形变体数量，混乱度为0时不使用变体"""
+        return self.glyph_variants if self.chaos_level > 0 else 1
+
+    def create_rng(self, seed=None):
+        """创建随机数生成器，seed为None时使用设置中的seed，设置了seed时结果可复现"""
+        seed = self.seed if seed is None else seed
+        if np is not None:
+            return np.random.default_rng(seed)
+        return random.Random(seed)
+
+    def get_page_jitter(self, count, rng):
+        """
+        一页中所有字符的随机偏移和变体一次生成，返回(x偏移数组, y偏移数组, 变体数组)。
+        随机数按字符依次生成（x偏移、y偏移、变体），前面的字符不受后面字符数量的影响，
+        实时预览中增删一个字时只有它之后的字符会变
+        """
+        # 混乱度越高，偏移范围越大
+        max_offset = self.chaos_level * 2
+        variant_count = self.get_variant_count()
+        if np is not None:
+            values = rng.integers(np.array([-max_offset, -max_offset, 0]),
+                                  np.array([max_offset, max_offset, variant_count - 1]),
+                                  size=(count, 3), endpoint=True, dtype=np.int16)
+            return (array('h', values[:, 0].tobytes()), array('h', values[:, 1].tobytes()),
+                    array('B', values[:, 2].astype(np.uint8).tobytes()))
+        offsets_x, offsets_y, variants = array('h'), array('h'), array('B')
+        for _ in range(count):
+            offsets_x.append(rng.randint(-max_offset, max_offset))
+            offsets_y.append(rng.randint(-max_offset, max_offset))
+            # 不使用变体时不消耗随机数
+            variants.append(rng.randrange(variant_count) if variant_count > 1 else 0)
+        return offsets_x, offsets_y, variants
+
+
+class PageSequence:
+    """多页渲染结果，排版已经完成，每一页在取用时才渲染，不会同时占用所有页面的内存"""
+
+    def __init__(self, renderer, plan, base, font, text_color, opacity):
+        self.renderer = renderer
+        self.plan = plan
+        self.pages = plan.pages
+        self.base = base
+        self.font = font
+        self.text_color = text_color
+        self.opacity = opacity
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __getitem__(self, index):
+        return self.renderer.render_page(self.pages[index], self.base, self.font, self.text_color, self.opacity)
+
+    def __iter__(self):
+        for index in range(len(self.pages)):
+            yield self[index]
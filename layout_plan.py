@@ -0,0 +1,87 @@
+from array import array
+import base64
+import json
+
+
+class PagePlan:
+    """一页的排版结果：字符编码、基准坐标、随机偏移和字形变体序号，使用紧凑数组保存"""
+
+    __slots__ = ('codes', 'xs', 'ys', 'offsets_x', 'offsets_y', 'variants')
+
+    def __init__(self, codes=None, xs=None, ys=None, offsets_x=None, offsets_y=None, variants=None):
+        self.codes = codes if codes is not None else array('I')
+        self.xs = xs if xs is not None else array('f')
+        self.ys = ys if ys is not None else array('f')
+        self.offsets_x = offsets_x if offsets_x is not None else array('h')
+        self.offsets_y = offsets_y if offsets_y is not None else array('h')
+        # 没有变体时全部使用原始字形
+        self.variants = variants if variants is not None else array('B', bytes(len(self.codes)))
+
+    def append(self, char, x, y, offset_x=0, offset_y=0, variant=0):
+        self.codes.append(ord(char))
+        self.xs.append(x)
+        self.ys.append(y)
+        self.offsets_x.append(offset_x)
+        self.offsets_y.append(offset_y)
+        self.variants.append(variant)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __iter__(self):
+        """依次返回(字符, 绘制x, 绘制y)，绘制坐标已加上随机偏移"""
+        for code, x, y, offset_x, offset_y in zip(self.codes, self.xs, self.ys, self.offsets_x, self.offsets_y):
+            yield chr(code), x + offset_x, y + offset_y
+
+    def to_dict(self):
+        return {name: base64.b64encode(getattr(self, name).tobytes()).decode('ascii') for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        arrays = {}
+        for name, typecode in zip(cls.__slots__, 'IffhhB'):
+            if name not in data:
+                # 旧版本保存的排版结果没有变体序号
+                continue
+            values = array(typecode)
+            values.frombytes(base64.b64decode(data[name]))
+            arrays[name] = values
+        return cls(**arrays)
+
+
+class LayoutPlan:
+    """整篇文档的排版结果，可以缓存或保存到文件，之后只需重新光栅化"""
+
+    def __init__(self, page_size, font_key, pages=None):
+        self.page_size = tuple(page_size)
+        # (字体路径, 字号)，用于渲染时取得同一个字体
+        self.font_key = tuple(font_key)
+        self.pages = pages if pages is not None else [PagePlan()]
+
+    def __len__(self):
+        return len(self.pages)
+
+    def __getitem__(self, index):
+        return self.pages[index]
+
+    def to_bytes(self):
+        data = {
+            'page_size': self.page_size,
+            'font_key': self.font_key,
+            'pages': [page.to_dict() for page in self.pages]
+        }
+        return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = json.loads(data.decode('utf-8'))
+        return cls(data['page_size'], data['font_key'], [PagePlan.from_dict(page) for page in data['pages']])
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
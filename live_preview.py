@@ -0,0 +1,196 @@
+from PIL import Image
+from layout_plan import PagePlan
+from render_cache import get_preview_size
+import difflib
+import itertools
+import math
+import random
+
+
+def make_preview_image(img, max_preview_size=800):
+    """把页面缩放到预览尺寸，保持原始比例"""
+    return img.resize(get_preview_size(img.size, max_preview_size), Image.Resampling.LANCZOS)
+
+
+class LivePreview:
+    """实时预览：与上一次的排版结果比较，只重新渲染改动过的行"""
+
+    def __init__(self, renderer, max_preview_size=800):
+        self.renderer = renderer
+        self.max_preview_size = max_preview_size
+        self.reset()
+
+    def reset(self):
+        """清空上一次的排版和预览，下次更新时整页重新渲染"""
+        self.state_key = None
+        # 没有设置seed时预览使用一个固定的随机种子，输入时未改动的文字不会跳动
+        self.preview_seed = random.randrange(2 ** 32)
+        self.paragraphs = []
+        self.paragraph_lines = []
+        self.placed_lines = []
+        self.page_index = None
+        self.page_img = None
+        self.preview_img = None
+
+    def get_state_key(self, font, base):
+        """除文字内容以外影响预览结果的设置，变化后需要整页重新渲染"""
+        renderer = self.renderer
+        return (
+            renderer.get_layout_key('', font, base.size)[1:],
+            renderer.text_color,
+            renderer.text_opacity,
+            renderer.background['current'],
+            renderer.background['color']
+        )
+
+    def update(self, text):
+        """
+        根据新的文本更新预览，返回(是否整页更新, 预览图, [(预览图中的区域, 区域图片), ...])
+        整页更新时区域列表为空，直接显示预览图即可；局部更新时预览图为None，只返回改动的区域。
+        返回的图片都是副本，可以交给界面线程使用，之后的更新不会修改它们
+        """
+        with self.renderer.profiler.record('live_preview'):
+            return self.update_preview(text)
+
+    def update_preview(self, text):
+        renderer = self.renderer
+        base = renderer.get_base_page()
+        font = renderer.get_font()
+        state_key = self.get_state_key(font, base)
+        if state_key != self.state_key:
+            self.reset()
+            self.state_key = state_key
+        metrics = renderer.get_line_metrics(font, base.size)
+
+        # 按段落比较，未改动的段落沿用上次的折行结果
+        paragraphs = text.split('\n')
+        paragraph_lines = []
+        matcher = difflib.SequenceMatcher(None, self.paragraphs, paragraphs, autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                paragraph_lines.extend(self.paragraph_lines[i1:i2])
+            else:
+                paragraph_lines.extend(renderer.break_paragraph(paragraph, font, metrics)
+                                       for paragraph in paragraphs[j1:j2])
+
+        lines = [line for lines in paragraph_lines for line in lines]
+        placed_lines = self.add_jitter(renderer.paginate(lines, metrics))
+
+        # 位置或内容发生变化的行
+        old_lines = self.placed_lines
+        dirty = [index for index in range(max(len(old_lines), len(placed_lines)))
+                 if index >= len(old_lines) or index >= len(placed_lines)
+                 or old_lines[index] != placed_lines[index]]
+
+        # 显示最先发生改动的那一页
+        page_index = self.page_index
+        if dirty:
+            first = dirty[0]
+            page_index = placed_lines[first][0] if first < len(placed_lines) else old_lines[first][0]
+        last_page = placed_lines[-1][0] if placed_lines else 0
+        page_index = min(page_index or 0, last_page)
+
+        self.paragraphs = paragraphs
+        self.paragraph_lines = paragraph_lines
+        self.placed_lines = placed_lines
+
+        if self.page_img is None or page_index != self.page_index:
+            # 换页或首次预览，整页渲染
+            self.page_index = page_index
+            self.page_img = renderer.render_page(self.get_page_glyphs(page_index), base, font,
+                                                 renderer.text_color, int(renderer.text_opacity * 255))
+            with renderer.profiler.stage('preview_resize'):
+                self.preview_img = make_preview_image(self.page_img, self.max_preview_size)
+            return True, self.preview_img.copy(), []
+
+        # 只重新渲染本页中改动过的行所在的区域
+        dirty_rows = [self.get_line_rows(*old_lines[index][1:], font) for index in dirty
+                      if index < len(old_lines) and old_lines[index][0] == page_index]
+        dirty_rows += [self.get_line_rows(*placed_lines[index][1:], font) for index in dirty
+                       if index < len(placed_lines) and placed_lines[index][0] == page_index]
+        dirty_rows = [rows for rows in dirty_rows if rows is not None]
+        if not dirty_rows:
+            return False, None, []
+        top = max(0, min(row[0] for row in dirty_rows))
+        bottom = min(base.height, max(row[1] for row in dirty_rows))
+        return False, None, [self.redraw_rows(top, bottom, base, font)]
+
+    def add_jitter(self, placed_lines):
+        """
+        按页给[(页码, y, [(字符, x), ...]), ...]加上随机偏移和字形变体，
+        随机数的生成器和每页的生成顺序与iter_page_plans()相同，设置了seed时预览与保存的图片一致
+        """
+        renderer = self.renderer
+        seed = renderer.seed if renderer.seed is not None else self.preview_seed
+        rng = renderer.create_rng(seed)
+        result = []
+        for _, page_lines in itertools.groupby(placed_lines, key=lambda placed: placed[0]):
+            page_lines = list(page_lines)
+            count = sum(len(line) for _, _, line in page_lines)
+            # 只有空行的页面不生成随机数
+            if count:
+                offsets_x, offsets_y, variants = renderer.get_page_jitter(count, rng)
+            index = 0
+            for page_index, y, line in page_lines:
+                result.append((page_index, y, [(char, x, offsets_x[index + i], offsets_y[index + i],
+                                                variants[index + i]) for i, (char, x) in enumerate(line)]))
+                index += len(line)
+        return result
+
+    def get_page_glyphs(self, page_index):
+        """把某一页的行转换为PagePlan"""
+        page = PagePlan()
+        for line_page, y, line in self.placed_lines:
+            if line_page == page_index:
+                for char, x, offset_x, offset_y, variant in line:
+                    page.append(char, x, y, offset_x, offset_y, variant)
+        return page
+
+    def get_line_rows(self, y, line, font):
+        """一行字形蒙版实际覆盖的纵向范围[上, 下)，含随机偏移、回退字体和字形变体，没有墨迹时返回None"""
+        renderer = self.renderer
+        glyphs = [(char, x + offset_x, y + offset_y) for char, x, offset_x, offset_y, _ in line]
+        variants = [variant for *_, variant in line]
+        rows = None
+        for _, top, mask in renderer.iter_glyph_masks(glyphs, font, renderer.text_color,
+                                                      int(renderer.text_opacity * 255), variants):
+            bottom = top + mask.size[1]
+            rows = (top, bottom) if rows is None else (min(rows[0], top), max(rows[1], bottom))
+        return rows
+
+    def redraw_rows(self, top, bottom, base, font):
+        """重新渲染页面中[top, bottom)的横条，并更新预览图中对应的区域"""
+        renderer = self.renderer
+        output_width, output_height = self.page_img.size
+        preview_width, preview_height = self.preview_img.size
+        scale = preview_height / output_height
+
+        # 预览图中受影响的行，再换算回原图，保证缩放后的边缘对齐
+        preview_top = max(0, math.floor(top * scale) - 1)
+        preview_bottom = min(preview_height, math.ceil(bottom * scale) + 1)
+        top = math.floor(preview_top / scale)
+        bottom = min(output_height, math.ceil(preview_bottom / scale))
+
+        # 把底图的横条恢复出来，再贴上与其相交的所有行的字形
+        region = base.crop((0, top, output_width, bottom))
+        glyphs = []
+        variants = []
+        for line_page, y, line in self.placed_lines:
+            if line_page != self.page_index:
+                continue
+            rows = self.get_line_rows(y, line, font)
+            if rows is not None and rows[1] > top and rows[0] < bottom:
+                glyphs.extend((char, x + offset_x, y + offset_y) for char, x, offset_x, offset_y, _ in line)
+                variants.extend(variant for *_, variant in line)
+        with renderer.profiler.stage('raster'):
+            renderer.paste_glyphs(region, glyphs, font, renderer.text_color, int(renderer.text_opacity * 255),
+                                  origin=(0, top), variants=variants)
+        renderer.profiler.count('glyphs', len(glyphs))
+        self.page_img.paste(region, (0, top))
+
+        box = (0, preview_top, preview_width, preview_bottom)
+        with renderer.profiler.stage('preview_resize'):
+            tile = self.page_img.resize((preview_width, preview_bottom - preview_top), Image.Resampling.LANCZOS,
+                                        box=(0, preview_top / scale, output_width, preview_bottom / scale))
+        self.preview_img.paste(tile, box[:2])
+        return box, tile
@@ -0,0 +1,224 @@
+"""
+生成结果的磁盘缓存：相同的文本、设置、字体文件、背景文件和随机种子总是得到相同的图片，
+命中时直接复制保存过的PNG，不再重新渲染
+
+用法：
+    python output_cache.py --purge      # 清空缓存
+    python output_cache.py --stats      # 查看缓存大小
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+# 缓存保存的位置
+OUTPUT_CACHE_DIR = os.path.join('cache', 'output')
+
+# 渲染算法改变时增加版本号，旧的缓存自然失效
+CACHE_VERSION = 3
+
+
+class OutputCache:
+    """按内容哈希保存生成的页面，超过容量时删除最久未使用的结果"""
+
+    def __init__(self, cache_dir=OUTPUT_CACHE_DIR, max_bytes=1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # 文件内容哈希，按(路径, 修改时间, 大小)缓存，避免每次都读取整个文件
+        self._file_hashes = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings, cache_dir=OUTPUT_CACHE_DIR):
+        """按设置中的output_cache项创建，如 "output_cache": {"enabled": true, "max_size_mb": 1024}
+        未启用时返回None"""
+        options = settings.get('output_cache') or {}
+        if not options.get('enabled', True):
+            return None
+        return cls(cache_dir, int(options.get('max_size_mb', 1024)) * 1024 * 1024)
+
+    def get_file_hash(self, path):
+        """文件内容的sha1，文件不存在时返回None"""
+        if not path:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        stat_key = (os.path.abspath(path), stat.st_mtime, stat.st_size)
+        with self._lock:
+            digest = self._file_hashes.get(stat_key)
+        if digest is None:
+            sha1 = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    sha1.update(chunk)
+            digest = sha1.hexdigest()
+            with self._lock:
+                self._file_hashes[stat_key] = digest
+        return digest
+
+    @staticmethod
+    def get_file_stat(path):
+        """文件的(修改时间, 大小)，不读取内容；文件不存在（如系统字体）时返回None"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def get_key(self, renderer, text, extra=None):
+        """计算缓存键，没有设置随机种子时每次结果不同，返回None表示不缓存"""
+        if renderer.seed is None:
+            return None
+        font = renderer.get_font()
+        font_path = getattr(font, 'path', None)
+        content = {
+            'version': CACHE_VERSION,
+            'text': text,
+            'font_size': renderer.font_size,
+            'text_color': renderer.text_color,
+            'text_opacity': renderer.text_opacity,
+            'text_spacing': renderer.text_spacing,
+            'chaos_level': renderer.chaos_level,
+            'glyph_variants': renderer.get_variant_count(),
+            'seed': renderer.seed,
+            'margins': renderer.margins,
+            'background_color': renderer.background['color'],
+            # 文件按内容区分，同名文件被替换后缓存失效
+            'font': self.get_file_hash(font_path) if isinstance(font_path, str) else None,
+            # 系统字体（如msyh.ttc）和内置字体没有可读取的文件，按名称和字号区分
+            'font_name': font_path if isinstance(font_path, str) else type(font).__name__,
+            'font_size_loaded': getattr(font, 'size', None),
+            # 缺字时使用的回退字体，可能有几百个，只按修改时间和大小区分
+            'fallback_fonts': [[path, self.get_file_stat(path)] for path in renderer.fallback_paths],
+            'background': self.get_file_hash(renderer.background['current']),
+            'extra': extra
+        }
+        data = json.dumps(content, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def get_entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key):
+        """返回缓存的页面文件列表，未命中时返回None"""
+        if key is None:
+            return None
+        entry_dir = self.get_entry_dir(key)
+        try:
+            with open(os.path.join(entry_dir, 'pages.json'), 'r', encoding='utf-8') as f:
+                pages = json.load(f)
+            paths = [os.path.join(entry_dir, name) for name in pages]
+            if not all(os.path.exists(path) for path in paths):
+                return None
+            # 更新修改时间，淘汰时按最近使用排序
+            os.utime(entry_dir)
+            return paths
+        except (OSError, ValueError):
+            return None
+
+    def restore(self, key, get_filename):
+        """把缓存的页面复制到输出位置，get_filename(序号, 页数)返回文件名；未命中时返回None"""
+        paths = self.get(key)
+        if paths is None:
+            return None
+        filenames = []
+        try:
+            for index, path in enumerate(paths):
+                filename = get_filename(index, len(paths))
+                shutil.copyfile(path, filename)
+                filenames.append(filename)
+            return filenames
+        except OSError as e:
+            print(f"读取生成结果缓存失败: {str(e)}")
+            return None
+
+    def put(self, key, filenames):
+        """把已保存的页面文件加入缓存"""
+        if key is None or not filenames:
+            return
+        entry_dir = self.get_entry_dir(key)
+        if os.path.exists(entry_dir):
+            return
+        temp_dir = f'{entry_dir}.{os.getpid()}.{threading.get_ident()}.tmp'
+        try:
+            os.makedirs(temp_dir)
+            pages = []
+            for index, filename in enumerate(filenames):
+                name = f'{index + 1}{os.path.splitext(filename)[1]}'
+                shutil.copyfile(filename, os.path.join(temp_dir, name))
+                pages.append(name)
+            with open(os.path.join(temp_dir, 'pages.json'), 'w', encoding='utf-8') as f:
+                json.dump(pages, f)
+            # 写完后再改名，其他进程不会读到一半的结果
+            os.rename(temp_dir, entry_dir)
+        except OSError as e:
+            # 其他进程同时写入了相同的结果
+            if not os.path.exists(entry_dir):
+                print(f"保存生成结果缓存失败: {str(e)}")
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            return
+        self.evict()
+
+    def get_entries(self):
+        """返回[(最近使用时间, 大小, 目录), ...]"""
+        entries = []
+        if not os.path.exists(self.cache_dir):
+            return entries
+        for prefix in os.listdir(self.cache_dir):
+            prefix_dir = os.path.join(self.cache_dir, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for name in os.listdir(prefix_dir):
+                entry_dir = os.path.join(prefix_dir, name)
+                if name.endswith('.tmp'):
+                    continue
+                try:
+                    size = sum(entry.stat().st_size for entry in os.scandir(entry_dir))
+                    entries.append((os.stat(entry_dir).st_mtime, size, entry_dir))
+                except OSError:
+                    continue
+        return entries
+
+    def evict(self):
+        """总大小超过容量时，从最久未使用的结果开始删除"""
+        entries = self.get_entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_dir in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+
+    def stats(self):
+        entries = self.get_entries()
+        return {'entries': len(entries), 'bytes': sum(size for _, size, _ in entries)}
+
+    def purge(self):
+        """清空缓存"""
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        with self._lock:
+            self._file_hashes.clear()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="管理生成结果缓存")
+    parser.add_argument('--cache-dir', default=OUTPUT_CACHE_DIR, help="缓存文件夹，默认cache/output")
+    parser.add_argument('--purge', action='store_true', help="清空缓存")
+    parser.add_argument('--stats', action='store_true', help="显示缓存的结果数和大小")
+    args = parser.parse_args(argv)
+
+    cache = OutputCache(args.cache_dir)
+    if args.purge:
+        cache.purge()
+        print(f"已清空缓存：{args.cache_dir}")
+    stats = cache.stats()
+    print(f"缓存中共有{stats['entries']}个结果，{stats['bytes'] / 1024 / 1024:.1f}MB")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,179 @@
+"""
+输出格式：PNG（可调压缩级别）、JPEG、WebP和多页PDF。
+在settings.json中选择，如 "output": {"format": "jpeg", "quality": 90}
+"""
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import threading
+import time
+
+
+class ImageEncoder:
+    """保存图片并统计编码耗时和写入的字节数"""
+
+    format = 'PNG'
+    extension = '.png'
+    # 多页格式把所有页面保存到同一个文件
+    multi_page = False
+    default_options = {}
+
+    def __init__(self, **options):
+        self.options = dict(self.default_options)
+        self.options.update({name: value for name, value in options.items() if name in self.default_options})
+        self.pages = 0
+        self.encoded_bytes = 0
+        self.encode_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def get_key(self):
+        """影响输出文件内容的所有选项，用于生成结果缓存"""
+        return [self.format, sorted(self.options.items())]
+
+    def get_filename(self, prefix, index, count=None):
+        """第index页的文件名，只有一页或多页格式时不加页码，count为None表示页数未知"""
+        if self.multi_page or count == 1:
+            return f'{prefix}{self.extension}'
+        return f'{prefix}_{index + 1}{self.extension}'
+
+    def get_save_options(self, img):
+        return dict(self.options)
+
+    def prepare(self, img):
+        """转换为该格式支持的颜色模式"""
+        return img
+
+    def save(self, img, filename, append=False):
+        """保存一页，append为True时追加到多页文件的末尾，返回写入的字节数"""
+        start = time.perf_counter()
+        old_size = os.path.getsize(filename) if append and os.path.exists(filename) else 0
+        img = self.prepare(img)
+        if append:
+            img.save(filename, self.format, append=True, **self.get_save_options(img))
+        else:
+            img.save(filename, self.format, **self.get_save_options(img))
+        size = os.path.getsize(filename) - old_size
+        self.add_stats(size, time.perf_counter() - start)
+        return size
+
+    def encode_pages(self, pages):
+        """在内存中编码所有页面，返回每个文件的内容；多页格式只返回一个文件"""
+        results = []
+        for img in pages:
+            start = time.perf_counter()
+            buffer = io.BytesIO()
+            img = self.prepare(img)
+            img.save(buffer, self.format, **self.get_save_options(img))
+            data = buffer.getvalue()
+            self.add_stats(len(data), time.perf_counter() - start)
+            results.append(data)
+        return results
+
+    def add_stats(self, size, seconds, pages=1):
+        with self._lock:
+            self.pages += pages
+            self.encoded_bytes += size
+            self.encode_seconds += seconds
+
+    def stats(self):
+        with self._lock:
+            return {
+                'format': self.format,
+                'pages': self.pages,
+                'encoded_bytes': self.encoded_bytes,
+                'encode_ms': round(self.encode_seconds * 1000, 3)
+            }
+
+
+class PNGEncoder(ImageEncoder):
+    """无损PNG，compress_level为0-9，越小编码越快文件越大"""
+
+    default_options = {'compress_level': 6}
+
+
+class JPEGEncoder(ImageEncoder):
+    format = 'JPEG'
+    extension = '.jpg'
+    default_options = {'quality': 90, 'optimize': True}
+
+    def prepare(self, img):
+        return img.convert('RGB') if img.mode != 'RGB' else img
+
+
+class WebPEncoder(ImageEncoder):
+    """method为0-6，越小编码越快"""
+
+    format = 'WEBP'
+    extension = '.webp'
+    default_options = {'quality': 90, 'lossless': False, 'method': 4}
+
+
+class PDFEncoder(ImageEncoder):
+    """所有页面保存为一个PDF文件，逐页追加，不需要同时保留所有页面"""
+
+    format = 'PDF'
+    extension = '.pdf'
+    multi_page = True
+    default_options = {'quality': 90, 'resolution': 300.0}
+
+    def prepare(self, img):
+        return img.convert('RGB') if img.mode != 'RGB' else img
+
+    def encode_pages(self, pages):
+        """在内存中编码时一次保存所有页面"""
+        start = time.perf_counter()
+        images = [self.prepare(img) for img in pages]
+        if not images:
+            return []
+        buffer = io.BytesIO()
+        images[0].save(buffer, self.format, save_all=True, append_images=images[1:],
+                       **self.get_save_options(images[0]))
+        data = buffer.getvalue()
+        self.add_stats(len(data), time.perf_counter() - start, len(images))
+        return [data]
+
+
+ENCODERS = {
+    'png': PNGEncoder,
+    'jpeg': JPEGEncoder,
+    'jpg': JPEGEncoder,
+    'webp': WebPEncoder,
+    'pdf': PDFEncoder
+}
+
+
+def get_encoder(settings):
+    """按设置中的output项创建编码器，默认为PNG"""
+    options = dict(settings.get('output') or {})
+    output_format = str(options.pop('format', 'png')).lower()
+    encoder_class = ENCODERS.get(output_format)
+    if encoder_class is None:
+        print(f"未知的输出格式: {output_format}，使用PNG")
+        encoder_class = PNGEncoder
+    return encoder_class(**options)
+
+
+def write_pages(encoder, pages, filenames, profiler=None):
+    """
+    在后台线程中编码保存页面，同时在当前线程渲染下一页，最多同时保留两页。
+    按页面顺序返回(序号, 文件名, 写入的字节数)
+    """
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='encode') as executor:
+        pending = None
+        for index, (img, filename) in enumerate(zip(pages, filenames)):
+            future = executor.submit(encoder.save, img, filename, encoder.multi_page and index > 0)
+            if pending is not None:
+                yield pending[0], pending[1], wait_encoded(pending[2], profiler)
+            pending = (index, filename, future)
+        if pending is not None:
+            yield pending[0], pending[1], wait_encoded(pending[2], profiler)
+
+
+def wait_encoded(future, profiler=None):
+    """等待一页编码完成，等待时间计入encode阶段"""
+    if profiler is None:
+        return future.result()
+    with profiler.stage('encode'):
+        size = future.result()
+    profiler.count('encoded_bytes', size)
+    return size
@@ -0,0 +1,90 @@
+"""
+多页文档的并行渲染：排版完成后每一页互不相关，把各页分给进程池渲染并保存。
+底图放在共享内存中，工作进程直接引用，不需要逐个复制给每个进程
+"""
+from handwriting_renderer import HandwritingRenderer
+from output_encoders import get_encoder, write_pages
+from multiprocessing import shared_memory
+from PIL import Image
+import multiprocessing
+import os
+import time
+
+# 页数少于该值时启动进程池的开销大于收益，直接逐页渲染
+PARALLEL_MIN_PAGES = 4
+
+# 每个工作进程各自的渲染器、字体和共享内存中的底图
+_renderer = None
+_encoder = None
+_font = None
+_base = None
+_shared_base = None
+
+
+def share_base(base):
+    """把底图复制到共享内存，返回(共享内存, 传给工作进程的描述)"""
+    data = base.tobytes()
+    shm = shared_memory.SharedMemory(create=True, size=len(data))
+    shm.buf[:len(data)] = data
+    return shm, (shm.name, base.mode, base.size)
+
+
+def attach_base(description):
+    """在工作进程中打开共享内存中的底图，返回的图片不复制像素"""
+    name, mode, size = description
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, Image.frombuffer(mode, size, shm.buf, 'raw', mode, 0, 1)
+
+
+def init_worker(settings, fonts_dir, default_font, font_key, base_description):
+    """工作进程初始化：创建渲染器、加载排版时使用的字体并打开共享的底图"""
+    global _renderer, _encoder, _font, _base, _shared_base
+    _renderer = HandwritingRenderer(settings, fonts_dir=fonts_dir, default_font=default_font)
+    _encoder = get_encoder(settings)
+    _font = _renderer.get_font_by_key(font_key)
+    _shared_base, _base = attach_base(base_description)
+
+
+def render_and_save(task):
+    """渲染一页并保存，返回(页序号, 文件名, 写入的字节数, 编码耗时)"""
+    index, page, filename = task
+    img = _renderer.render_page(page, _base, _font, _renderer.text_color, int(_renderer.text_opacity * 255))
+    start = time.perf_counter()
+    size = _encoder.save(img, filename)
+    return index, filename, size, time.perf_counter() - start
+
+
+def save_pages_parallel(renderer, settings, pages, filenames, workers=None, encoder=None):
+    """
+    用进程池渲染并保存PageSequence中的所有页面，按完成顺序返回(页序号, 文件名, 写入的字节数)。
+    渲染使用同一份排版结果，与逐页渲染得到的图片完全相同
+    """
+    encoder = encoder or get_encoder(settings)
+    workers = min(workers or os.cpu_count() or 1, len(pages))
+    shm, base_description = share_base(pages.base)
+    try:
+        initargs = (settings, renderer.fonts_dir, renderer.default_font, pages.plan.font_key, base_description)
+        # 使用spawn启动进程，在界面程序的后台线程中调用也是安全的
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(workers, initializer=init_worker, initargs=initargs) as pool:
+            tasks = ((index, page, filename) for index, (page, filename) in enumerate(zip(pages.pages, filenames)))
+            for index, filename, size, seconds in pool.imap_unordered(render_and_save, tasks):
+                # 各进程的编码统计汇总到调用方的编码器
+                encoder.add_stats(size, seconds)
+                yield index, filename, size
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def save_pages(renderer, settings, pages, filenames, workers=None, encoder=None):
+    """
+    保存所有页面，页数较多且有多个CPU核心时并行渲染，按完成顺序返回(页序号, 文件名, 写入的字节数)。
+    PDF等多页格式需要按顺序追加，总是在当前进程中渲染
+    """
+    encoder = encoder or get_encoder(settings)
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(pages) >= PARALLEL_MIN_PAGES and not encoder.multi_page:
+        yield from save_pages_parallel(renderer, settings, pages, filenames, workers, encoder)
+        return
+    yield from write_pages(encoder, pages, filenames, renderer.profiler)
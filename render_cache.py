@@ -0,0 +1,279 @@
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+from collections import OrderedDict
+import random
+import threading
+import os
+
+
+class LRUCache:
+    """带容量上限的LRU缓存，统计命中和未命中次数"""
+
+    def __init__(self, max_size=1024, sizeof=None):
+        self.max_size = max_size
+        # sizeof用于计算每个条目的占用大小，默认每个条目计为1
+        self.sizeof = sizeof or (lambda value: 1)
+        self.hits = 0
+        self.misses = 0
+        self.current_size = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key][0]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self.current_size -= self._data.pop(key)[1]
+            self._data[key] = (value, size)
+            self.current_size += size
+            # 超出上限时淘汰最久未使用的条目，至少保留刚放入的条目
+            while self.current_size > self.max_size and len(self._data) > 1:
+                _, (_, old_size) = self._data.popitem(last=False)
+                self.current_size -= old_size
+
+    def pop(self, key):
+        with self._lock:
+            if key in self._data:
+                value, size = self._data.pop(key)
+                self.current_size -= size
+                return value
+            return None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.current_size = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """返回缓存统计信息"""
+        return {
+            'entries': len(self._data),
+            'size': self.current_size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+
+class GlyphCache(LRUCache):
+    """字形缓存，保存预先渲染好的字形透明度蒙版和尺寸信息"""
+
+    def __init__(self, max_size=8 * 1024 * 1024):
+        # 按蒙版字节数计算容量，默认8MB
+        super().__init__(max_size, sizeof=lambda glyph: glyph[1].width * glyph[1].height if glyph[1] else 1)
+
+    def get_glyph(self, font, char, color='#000000', opacity=255):
+        """获取字符的(bbox, 蒙版)，蒙版已按透明度缩放，空白字符的蒙版为None"""
+        key = (getattr(font, 'path', id(font)), getattr(font, 'size', 0), char, color, opacity)
+        glyph = self.get(key)
+        if glyph is None:
+            glyph = self.render_glyph(font, char, opacity)
+            self.put(key, glyph)
+        return glyph
+
+    @staticmethod
+    def render_glyph(font, char, opacity=255):
+        """用FreeType光栅化单个字符"""
+        bbox = font.getbbox(char)
+        width, height = bbox[2] - bbox[0], bbox[3] - bbox[1]
+        if width <= 0 or height <= 0:
+            return bbox, None
+        mask = Image.new('L', (width, height), 0)
+        ImageDraw.Draw(mask).text((-bbox[0], -bbox[1]), char, font=font, fill=255)
+        if opacity < 255:
+            mask = mask.point(lambda value: value * opacity // 255)
+        return bbox, mask
+
+
+class GlyphVariantCache(LRUCache):
+    """
+    字形变体缓存：每个字形预先生成若干个略有旋转、缩放和笔画粗细变化的版本，
+    同一个字在页面中出现多次时随机选用，绘制时仍然只需贴一次图
+    """
+
+    def __init__(self, max_size=32 * 1024 * 1024):
+        # 按所有变体的蒙版字节数计算容量，默认32MB
+        super().__init__(max_size, sizeof=lambda variants: sum(
+            mask.width * mask.height if mask else 1 for _, mask in variants))
+
+    def get_variant(self, font, char, opacity, chaos_level, count, variant):
+        """获取第variant个变体的(bbox, 蒙版)，0为原始字形"""
+        key = (getattr(font, 'path', id(font)), getattr(font, 'size', 0), char, opacity, chaos_level, count)
+        variants = self.get(key)
+        if variants is None:
+            variants = self.render_variants(font, char, opacity, chaos_level, count)
+            self.put(key, variants)
+        return variants[variant % count]
+
+    @classmethod
+    def render_variants(cls, font, char, opacity, chaos_level, count):
+        """一次生成一个字形的所有变体"""
+        bbox, mask = GlyphCache.render_glyph(font, char)
+        variants = [(bbox, mask)]
+        for variant in range(1, count):
+            if mask is None:
+                variants.append((bbox, None))
+                continue
+            # 变化由字符和序号决定，不同进程中生成的变体完全相同
+            rng = random.Random(f'{ord(char)}:{variant}:{chaos_level}')
+            variants.append(cls.transform(bbox, mask, rng, chaos_level))
+        if opacity < 255:
+            variants = [(bbox, mask.point(lambda value: value * opacity // 255) if mask else None)
+                        for bbox, mask in variants]
+        return variants
+
+    @staticmethod
+    def transform(bbox, mask, rng, chaos_level):
+        """混乱度越高变化越大：混乱度10时最多旋转6度、缩放8%"""
+        angle = rng.uniform(-1, 1) * chaos_level * 0.6
+        scale = 1 + rng.uniform(-1, 1) * chaos_level * 0.008
+        weight = rng.uniform(-1, 1) * chaos_level * 0.03
+
+        width = max(1, round(mask.width * scale))
+        height = max(1, round(mask.height * scale))
+        img = mask.resize((width, height), Image.Resampling.BICUBIC)
+        if weight:
+            # 与加粗或变细后的字形混合，改变笔画粗细
+            stroke = img.filter(ImageFilter.MaxFilter(3) if weight > 0 else ImageFilter.MinFilter(3))
+            img = Image.blend(img, stroke, abs(weight))
+        img = img.rotate(angle, Image.Resampling.BICUBIC, expand=True)
+
+        # 以原字形的中心为中心放置
+        center_x = (bbox[0] + bbox[2]) / 2
+        center_y = (bbox[1] + bbox[3]) / 2
+        left = round(center_x - img.width / 2)
+        top = round(center_y - img.height / 2)
+        return (left, top, left + img.width, top + img.height), img
+
+
+class FontCache(LRUCache):
+    """字体缓存，避免重复解析体积很大的中文字体文件"""
+
+    def __init__(self, max_size=16, on_invalidate=None):
+        super().__init__(max_size)
+        # 字体文件被修改时调用，用于清理依赖该字体的其他缓存
+        self.on_invalidate = on_invalidate
+
+    def get_font(self, path, size, index=0):
+        """获取FreeTypeFont，字体文件修改后自动重新加载"""
+        key = (path, size, index)
+        mtime = self.get_mtime(path)
+        entry = self.get(key)
+        if entry is not None:
+            if entry[0] == mtime:
+                return entry[1]
+            # 字体文件已变化，丢弃旧的缓存
+            self.pop(key)
+            if self.on_invalidate:
+                self.on_invalidate()
+        font = ImageFont.truetype(path, size, index=index)
+        self.put(key, (mtime, font))
+        return font
+
+    @staticmethod
+    def get_mtime(path):
+        # 系统字体（如msyh.ttc）可能不在当前目录，此时没有修改时间
+        try:
+            return os.path.getmtime(path)
+        except OSError:
+            return None
+
+
+class BackgroundCache(LRUCache):
+    """背景缓存，保存解码并合成好的底图，每次渲染只需复制一份"""
+
+    def __init__(self, max_size=256 * 1024 * 1024):
+        # 按解码后的像素字节数计算容量，默认256MB
+        super().__init__(max_size, sizeof=lambda img: img.width * img.height * len(img.getbands()))
+
+    def get_base(self, path, color, default_size=(1000, 1000)):
+        """获取底图，path为None时返回纯色底图。返回的图片不可修改，需要先copy()"""
+        mtime = FontCache.get_mtime(path) if path else None
+        key = (path, color, mtime)
+        base = self.get(key)
+        if base is None:
+            base = self.load_base(path, color, default_size)
+            self.put(key, base)
+        return base
+
+    @staticmethod
+    def load_base(path, color, default_size=(1000, 1000)):
+        """解码背景图片，透明背景先合成到背景色上"""
+        if not path:
+            return Image.new('RGB', default_size, color=color)
+        with Image.open(path) as bg_img:
+            bg_img.load()
+            if bg_img.mode == 'RGBA':
+                img = Image.new('RGBA', bg_img.size, color=color)
+                return Image.alpha_composite(img, bg_img)
+            # 字形按颜色贴图，统一转换为RGB
+            return bg_img.convert('RGB')
+
+    def get_size(self, path, default_size=(1000, 1000)):
+        """背景图片的尺寸，只读取文件头，不解码"""
+        if not path:
+            return default_size
+        with Image.open(path) as bg_img:
+            return bg_img.size
+
+    def get_preview_base(self, path, color, max_preview_size, default_size=(1000, 1000)):
+        """获取缩小到预览尺寸的底图，不需要先解码原尺寸的背景图片"""
+        mtime = FontCache.get_mtime(path) if path else None
+        key = ('preview', path, color, mtime, max_preview_size)
+        base = self.get(key)
+        if base is None:
+            base = self.load_preview_base(path, color, max_preview_size, default_size)
+            self.put(key, base)
+        return base
+
+    @staticmethod
+    def load_preview_base(path, color, max_preview_size, default_size=(1000, 1000)):
+        if not path:
+            return Image.new('RGB', get_preview_size(default_size, max_preview_size), color=color)
+        with Image.open(path) as bg_img:
+            preview_size = get_preview_size(bg_img.size, max_preview_size)
+            # JPEG直接按1/2、1/4或1/8的尺寸解码
+            bg_img.draft('RGB', preview_size)
+            bg_img.load()
+            if bg_img.mode == 'RGBA':
+                img = Image.alpha_composite(Image.new('RGBA', bg_img.size, color=color), bg_img)
+            else:
+                img = bg_img.convert('RGB')
+        return img.resize(preview_size, Image.Resampling.LANCZOS)
+
+
+def get_preview_size(size, max_preview_size=800):
+    """缩放到预览尺寸后的大小，保持原始比例"""
+    output_width, output_height = size
+    ratio = min(max_preview_size / output_width, max_preview_size / output_height)
+    return int(output_width * ratio), int(output_height * ratio)
+
+
+# 进程内共享的缓存
+glyph_cache = GlyphCache()
+variant_cache = GlyphVariantCache()
+
+
+def clear_glyph_caches():
+    glyph_cache.clear()
+    variant_cache.clear()
+
+
+font_cache = FontCache(on_invalidate=clear_glyph_caches)
+background_cache = BackgroundCache()
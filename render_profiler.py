@@ -0,0 +1,161 @@
+from contextlib import contextmanager
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger('handwriting_renderer')
+
+
+class LogSink:
+    """把每次渲染的统计写入日志"""
+
+    def __call__(self, record):
+        logger.info(json.dumps(record, ensure_ascii=False))
+
+
+class JsonLinesSink:
+    """把每次渲染的统计追加到JSON Lines文件"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+
+def parse_sinks(spec):
+    """解析输出目标，如"log,jsonl:profile.jsonl"；也可以直接传入可调用对象的列表"""
+    if not spec:
+        return []
+    if isinstance(spec, str):
+        spec = [item.strip() for item in spec.split(',') if item.strip()]
+    sinks = []
+    for item in spec:
+        if callable(item):
+            sinks.append(item)
+        elif item == 'log':
+            sinks.append(LogSink())
+        elif item.startswith('jsonl:'):
+            sinks.append(JsonLinesSink(item[len('jsonl:'):]))
+        else:
+            print(f"未知的性能统计输出: {item}")
+    return sinks
+
+
+class RenderProfiler:
+    """
+    可选的分阶段耗时统计。未启用时所有方法几乎没有开销
+
+    通过环境变量启用：
+        HANDWRITING_PROFILE=log,jsonl:profile.jsonl   统计结果的输出目标
+        HANDWRITING_CPROFILE=profiles                 用cProfile记录每次渲染并保存到该文件夹
+    或在设置中加入 "profile": {"sinks": "log", "cprofile": "profiles"}
+    """
+
+    def __init__(self, sinks=None, cprofile_dir=None, caches=None):
+        # 未在设置中指定时使用的配置（通常来自环境变量）
+        self.default_config = (sinks, cprofile_dir)
+        self.config = None
+        self.callbacks = []
+        # 需要统计命中率的缓存，名称 -> 缓存对象
+        self.caches = caches or {}
+        self._local = threading.local()
+        self.configure(None)
+
+    @classmethod
+    def from_env(cls, caches=None):
+        return cls(os.environ.get('HANDWRITING_PROFILE'), os.environ.get('HANDWRITING_CPROFILE'), caches)
+
+    def configure(self, settings):
+        """按设置中的profile项启用，设置中没有时使用环境变量的配置"""
+        if settings:
+            config = (settings.get('sinks', 'log'), settings.get('cprofile'))
+        else:
+            config = self.default_config
+        if config != self.config:
+            self.config = config
+            self.sinks = parse_sinks(config[0])
+            self.cprofile_dir = config[1]
+
+    def add_sink(self, sink):
+        """添加回调，参数为一次渲染的统计字典"""
+        self.callbacks.append(sink)
+
+    @property
+    def enabled(self):
+        return bool(self.sinks or self.callbacks or self.cprofile_dir)
+
+    @contextmanager
+    def record(self, name):
+        """统计一次完整的渲染，结束时把各阶段耗时和计数交给输出目标"""
+        if not self.enabled or getattr(self._local, 'current', None) is not None:
+            yield
+            return
+        current = {'name': name, 'stages': {}, 'counters': {}}
+        cache_stats = {cache_name: cache.stats() for cache_name, cache in self.caches.items()}
+        profile = cProfile.Profile() if self.cprofile_dir else None
+        self._local.current = current
+        start = time.perf_counter()
+        if profile:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile:
+                profile.disable()
+            current['total_ms'] = round((time.perf_counter() - start) * 1000, 3)
+            self._local.current = None
+            # 本次渲染中各缓存的命中和未命中次数
+            for cache_name, cache in self.caches.items():
+                stats = cache.stats()
+                current['counters'][f'{cache_name}_hits'] = stats['hits'] - cache_stats[cache_name]['hits']
+                current['counters'][f'{cache_name}_misses'] = stats['misses'] - cache_stats[cache_name]['misses']
+            current['timestamp'] = time.strftime('%Y-%m-%d %H:%M:%S')
+            if profile:
+                current['cprofile'] = self.dump_profile(profile, name)
+            for sink in self.sinks + self.callbacks:
+                try:
+                    sink(current)
+                except Exception as e:
+                    print(f"输出性能统计失败: {str(e)}")
+
+    @contextmanager
+    def stage(self, name):
+        """统计一个阶段的耗时，同一阶段多次执行时累加"""
+        current = getattr(self._local, 'current', None)
+        if current is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            current['stages'][name] = round(current['stages'].get(name, 0) + elapsed, 3)
+
+    def count(self, name, value=1):
+        """累加计数，如绘制的字数"""
+        current = getattr(self._local, 'current', None)
+        if current is not None:
+            current['counters'][name] = current['counters'].get(name, 0) + value
+
+    def dump_profile(self, profile, name):
+        if not os.path.exists(self.cprofile_dir):
+            os.makedirs(self.cprofile_dir)
+        timestamp = datetime_suffix()
+        path = os.path.join(self.cprofile_dir, f'{name}_{timestamp}.prof')
+        profile.dump_stats(path)
+        return path
+
+
+def datetime_suffix():
+    """文件名用的时间戳，精确到毫秒避免重名"""
+    now = time.time()
+    return time.strftime('%Y%m%d_%H%M%S', time.localtime(now)) + f'_{int(now * 1000) % 1000:03d}'
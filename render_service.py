@@ -0,0 +1,458 @@
+"""
+本地HTTP渲染服务：常驻进程，字体、背景和字形缓存在请求之间保持加载状态
+
+用法：
+    python render_service.py --port 8765 --workers 2 --queue 8
+
+接口：
+    POST /render    请求体为JSON：{"text": "要转换的文字", "settings": {...}, "page": 1, "format": "png"}
+                    settings中的项覆盖服务启动时加载的设置，只接受CLIENT_SETTINGS中的排版项，
+                    字体和背景只能使用/health中列出的文件名；
+                    指定page或输出格式为PDF时直接返回文件内容，否则返回JSON：
+                    {"format": "png", "pages": [base64, ...], "encode_ms": ..., "encoded_bytes": ...}
+    GET  /health    服务状态
+    GET  /metrics   请求数、排队情况、延迟分位数和缓存命中率
+"""
+from handwriting_renderer import HandwritingRenderer, load_settings, merge_settings
+from output_encoders import ENCODERS, get_encoder
+from render_cache import glyph_cache, variant_cache, font_cache, background_cache
+from asset_catalog import AssetCatalog
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import deque
+from PIL import ImageColor
+import argparse
+import base64
+import json
+import os
+import threading
+import time
+
+# 单次请求的文字上限（字符数）
+MAX_TEXT_LENGTH = 200000
+
+# 请求体的大小上限（字节），UTF-8中一个字最多4字节，另外留出设置项的空间
+MAX_BODY_SIZE = MAX_TEXT_LENGTH * 4 + 65536
+
+# 客户端可以覆盖的设置项及取值范围，字体、背景和输出格式单独检查。
+# 其余设置（性能统计、结果缓存等）只能在服务端的设置文件中修改
+CLIENT_SETTINGS = {
+    'font_size': (int, 8, 200),
+    'text_color': ('color',),
+    'text_opacity': (float, 0, 1),
+    'chaos_level': (int, 0, 10),
+    'glyph_variants': (int, 1, 16),
+    'seed': (int, 0, 2 ** 63 - 1),
+    'text_spacing': {
+        'horizontal': (int, -50, 500),
+        'vertical': (int, -50, 500)
+    },
+    'margins': {
+        'left': (int, 0, 2000),
+        'right': (int, 0, 2000),
+        'top': (int, 0, 2000),
+        'bottom': (int, 0, 2000)
+    }
+}
+
+# 客户端可以指定的输出选项
+OUTPUT_QUALITY_RANGE = (1, 100)
+
+CONTENT_TYPES = {
+    'PNG': 'image/png',
+    'JPEG': 'image/jpeg',
+    'WEBP': 'image/webp',
+    'PDF': 'application/pdf'
+}
+
+
+class ServiceError(Exception):
+    """返回给客户端的错误，带HTTP状态码"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class RenderService:
+    """处理渲染请求：固定数量的渲染线程，排队的请求数有上限，超过时立即拒绝"""
+
+    def __init__(self, settings, fonts_dir='fonts', background_dir='background', workers=2, queue_size=8,
+                 timeout=60):
+        self.settings = settings
+        self.fonts_dir = fonts_dir
+        self.background_dir = background_dir
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='render')
+        # 正在渲染和排队的请求总数不超过workers + queue_size
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        # 每个渲染线程各自的渲染器，缓存在所有线程之间共享
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.pending = 0
+        self.active = 0
+        self.counters = {'requests': 0, 'completed': 0, 'rejected': 0, 'timeouts': 0, 'errors': 0, 'pages': 0,
+                         'encoded_bytes': 0}
+        self.latencies = deque(maxlen=1000)
+        # 启动时刷新一次字体和背景目录
+        self.asset_catalog = AssetCatalog(fonts_dir, background_dir)
+        self.asset_catalog.refresh()
+        self.fonts = self.asset_catalog.font_names()
+        self.backgrounds = self.asset_catalog.background_names()
+
+    def warm(self):
+        """预先加载默认设置的字体和背景，并测量常用字符的尺寸，第一个请求不需要等待"""
+        renderer = HandwritingRenderer(self.settings, fonts_dir=self.fonts_dir, asset_catalog=self.asset_catalog)
+        font = renderer.get_font()
+        renderer.get_base_page()
+        chain = renderer.get_font_chain(font)
+        chain.metrics.warm()
+        chain.save()
+
+    def get_renderer(self):
+        renderer = getattr(self._local, 'renderer', None)
+        if renderer is None:
+            renderer = self._local.renderer = HandwritingRenderer(self.settings, fonts_dir=self.fonts_dir,
+                                                                  asset_catalog=self.asset_catalog)
+        return renderer
+
+    def parse_request(self, payload):
+        """检查请求内容，返回(文字, 设置, 页码)"""
+        if not isinstance(payload, dict):
+            raise ServiceError(400, "请求体必须是JSON对象")
+        text = payload.get('text')
+        if not isinstance(text, str) or not text.strip():
+            raise ServiceError(400, "缺少要转换的文字")
+        if len(text) > MAX_TEXT_LENGTH:
+            raise ServiceError(413, f"文字超过{MAX_TEXT_LENGTH}字")
+        overrides = payload.get('settings') or {}
+        if not isinstance(overrides, dict):
+            raise ServiceError(400, "settings必须是JSON对象")
+        settings = merge_settings(self.settings, self.check_settings(overrides))
+        if payload.get('format'):
+            settings['output'] = dict(settings.get('output') or {}, format=self.check_format(payload['format']))
+        page = payload.get('page')
+        if page is not None and (not isinstance(page, int) or isinstance(page, bool) or page < 1):
+            raise ServiceError(400, "page必须是从1开始的整数")
+        return text, settings, page
+
+    def check_settings(self, overrides):
+        """只保留允许客户端修改的设置并检查类型和范围，字体和背景必须是目录中已有的文件"""
+        settings = self.check_values(overrides, CLIENT_SETTINGS, 'settings')
+        for key in overrides:
+            if key in CLIENT_SETTINGS:
+                continue
+            value = overrides[key]
+            if key == 'handwriting_font':
+                settings[key] = self.check_font(value, key)
+            elif key == 'fallback_fonts':
+                if value is not None and not isinstance(value, list):
+                    raise ServiceError(400, "fallback_fonts必须是字体文件名的列表")
+                settings[key] = None if value is None else [self.check_font(name, key) for name in value]
+            elif key == 'background':
+                settings[key] = self.check_background(value)
+            elif key == 'output':
+                settings[key] = self.check_output(value)
+            else:
+                raise ServiceError(400, f"不支持的设置项: {key}")
+        return settings
+
+    def check_values(self, values, schema, name):
+        """按schema检查一组数值设置，返回检查后的副本"""
+        result = {}
+        for key, spec in schema.items():
+            if key not in values:
+                continue
+            value = values[key]
+            path = f'{name}.{key}'
+            if isinstance(spec, dict):
+                if not isinstance(value, dict):
+                    raise ServiceError(400, f"{path}必须是JSON对象")
+                unknown = set(value) - set(spec)
+                if unknown:
+                    raise ServiceError(400, f"不支持的设置项: {path}.{sorted(unknown)[0]}")
+                result[key] = self.check_values(value, spec, path)
+            elif spec[0] == 'color':
+                result[key] = self.check_color(value, path)
+            elif key == 'seed' and value is None:
+                result[key] = None
+            else:
+                value_type, low, high = spec
+                # JSON中的true/false在Python中也是int
+                if isinstance(value, bool) or not isinstance(value, (int, float) if value_type is float else int):
+                    raise ServiceError(400, f"{path}必须是{'数字' if value_type is float else '整数'}")
+                if not low <= value <= high:
+                    raise ServiceError(400, f"{path}必须在{low}到{high}之间")
+                result[key] = value
+        return result
+
+    @staticmethod
+    def check_color(value, path):
+        try:
+            ImageColor.getrgb(value)
+        except (ValueError, AttributeError, TypeError):
+            raise ServiceError(400, f"{path}不是有效的颜色")
+        return value
+
+    def check_font(self, name, path):
+        if name is None and path == 'handwriting_font':
+            return None
+        if not isinstance(name, str) or name not in self.fonts:
+            raise ServiceError(400, f"{path}只能使用字体目录中的字体: {name}")
+        return name
+
+    def check_background(self, value):
+        """背景只接受背景目录中的文件名，转换为渲染器使用的路径"""
+        if not isinstance(value, dict):
+            raise ServiceError(400, "background必须是JSON对象")
+        unknown = set(value) - {'current', 'color'}
+        if unknown:
+            raise ServiceError(400, f"不支持的设置项: background.{sorted(unknown)[0]}")
+        background = {}
+        if 'current' in value:
+            name = value['current']
+            if name is not None and (not isinstance(name, str) or name not in self.backgrounds):
+                raise ServiceError(400, f"background.current只能使用背景目录中的图片: {name}")
+            background['current'] = os.path.join(self.background_dir, name) if name is not None else None
+        if 'color' in value:
+            background['color'] = self.check_color(value['color'], 'background.color')
+        return background
+
+    @staticmethod
+    def check_format(value):
+        if not isinstance(value, str) or value.lower() not in ENCODERS:
+            raise ServiceError(400, f"format只能是{'、'.join(ENCODERS)}")
+        return value.lower()
+
+    def check_output(self, value):
+        if not isinstance(value, dict):
+            raise ServiceError(400, "output必须是JSON对象")
+        unknown = set(value) - {'format', 'quality'}
+        if unknown:
+            raise ServiceError(400, f"不支持的设置项: output.{sorted(unknown)[0]}")
+        output = {}
+        if 'format' in value:
+            output['format'] = self.check_format(value['format'])
+        if 'quality' in value:
+            quality = value['quality']
+            low, high = OUTPUT_QUALITY_RANGE
+            if isinstance(quality, bool) or not isinstance(quality, int) or not low <= quality <= high:
+                raise ServiceError(400, f"output.quality必须是{low}到{high}之间的整数")
+            output['quality'] = quality
+        return output
+
+    def render(self, payload):
+        """处理一次渲染请求，返回(Content-Type, 响应内容)"""
+        text, settings, page = self.parse_request(payload)
+        with self._lock:
+            self.counters['requests'] += 1
+        if not self.slots.acquire(blocking=False):
+            with self._lock:
+                self.counters['rejected'] += 1
+            raise ServiceError(503, "服务繁忙，请稍后重试")
+        try:
+            future = self.executor.submit(self.render_job, text, settings, page)
+        except RuntimeError:
+            # 服务正在关闭
+            self.slots.release()
+            raise ServiceError(503, "服务正在关闭")
+        # 任务完成或未开始就被取消时都释放名额
+        future.add_done_callback(lambda _: self.slots.release())
+        start = time.perf_counter()
+        with self._lock:
+            self.pending += 1
+        try:
+            content_type, body, page_count, encoded_bytes = future.result(timeout=self.timeout)
+        except TimeoutError:
+            # 还没开始的任务直接取消，正在渲染的任务完成后结果被丢弃
+            future.cancel()
+            with self._lock:
+                self.counters['timeouts'] += 1
+            raise ServiceError(504, "渲染超时")
+        except ServiceError:
+            raise
+        except Exception as e:
+            with self._lock:
+                self.counters['errors'] += 1
+            raise ServiceError(500, f"渲染失败: {str(e)}")
+        finally:
+            with self._lock:
+                self.pending -= 1
+        with self._lock:
+            self.counters['completed'] += 1
+            self.counters['pages'] += page_count
+            self.counters['encoded_bytes'] += encoded_bytes
+            self.latencies.append((time.perf_counter() - start) * 1000)
+        return content_type, body
+
+    def render_job(self, text, settings, page):
+        """在渲染线程中执行，返回(Content-Type, 响应内容, 页数, 编码后的字节数)"""
+        with self._lock:
+            self.active += 1
+        try:
+            renderer = self.get_renderer()
+            renderer.update_settings(settings)
+            encoder = get_encoder(settings)
+            with renderer.profiler.record('service'):
+                pages = renderer.render_pages(text)
+                if page is not None:
+                    if page > len(pages):
+                        raise ServiceError(404, f"共{len(pages)}页，没有第{page}页")
+                    images = [pages[page - 1]]
+                else:
+                    images = pages
+                # 渲染在取用每一页时进行，编码耗时由编码器统计
+                files = encoder.encode_pages(images)
+            stats = encoder.stats()
+            content_type = CONTENT_TYPES[encoder.format]
+            if page is not None or encoder.multi_page:
+                return content_type, files[0], stats['pages'], stats['encoded_bytes']
+            body = json.dumps({
+                'format': encoder.format.lower(),
+                'content_type': content_type,
+                'page_count': len(files),
+                'pages': [base64.b64encode(data).decode('ascii') for data in files],
+                'encode_ms': stats['encode_ms'],
+                'encoded_bytes': stats['encoded_bytes']
+            }).encode('utf-8')
+            return 'application/json', body, stats['pages'], stats['encoded_bytes']
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def health(self):
+        with self._lock:
+            return {
+                'status': 'ok',
+                'uptime_seconds': round(time.time() - self.started, 1),
+                'workers': self.workers,
+                'active': self.active,
+                'queued': max(0, self.pending - self.active),
+                'queue_size': self.queue_size,
+                'fonts': self.fonts,
+                'backgrounds': self.backgrounds
+            }
+
+    def metrics(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            counters = dict(self.counters)
+        result = self.health()
+        result.update(counters)
+
+        def percentile(fraction):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, round(fraction * (len(latencies) - 1)))], 2)
+
+        result['latency_ms'] = {'p50': percentile(0.5), 'p90': percentile(0.9), 'p99': percentile(0.99)}
+        result['caches'] = {
+            'glyph_cache': glyph_cache.stats(),
+            'variant_cache': variant_cache.stats(),
+            'font_cache': font_cache.stats(),
+            'background_cache': background_cache.stats()
+        }
+        return result
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'HandwritingRenderService/1.0'
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == '/health':
+            self.send_json(200, service.health())
+        elif self.path == '/metrics':
+            self.send_json(200, service.metrics())
+        else:
+            self.send_json(404, {'error': "未知的接口"})
+
+    def do_POST(self):
+        if self.path != '/render':
+            self.send_json(404, {'error': "未知的接口"})
+            return
+        try:
+            content_type = self.headers.get('Content-Type', '').split(';')[0].strip().lower()
+            if content_type != 'application/json':
+                raise ServiceError(415, "Content-Type必须是application/json")
+            try:
+                length = int(self.headers.get('Content-Length', ''))
+            except ValueError:
+                raise ServiceError(411, "缺少有效的Content-Length")
+            if length < 0:
+                raise ServiceError(400, "Content-Length无效")
+            if length > MAX_BODY_SIZE:
+                # 不读取过大的请求体，直接关闭连接
+                self.close_connection = True
+                raise ServiceError(413, f"请求体超过{MAX_BODY_SIZE}字节")
+            try:
+                payload = json.loads(self.rfile.read(length).decode('utf-8'))
+            except ValueError:
+                raise ServiceError(400, "请求体不是有效的JSON")
+            content_type, body = self.server.service.render(payload)
+        except ServiceError as e:
+            headers = {'Retry-After': '1'} if e.status == 503 else {}
+            self.send_json(e.status, {'error': str(e)}, headers)
+            return
+        self.send_body(200, content_type, body)
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_body(status, 'application/json; charset=utf-8', body, headers)
+
+    def send_body(self, status, content_type, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # 只在出错时输出，避免每个请求都打印一行
+        pass
+
+
+def create_server(service, host='127.0.0.1', port=8765):
+    server = ThreadingHTTPServer((host, port), RenderRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地手写渲染HTTP服务")
+    parser.add_argument('--host', default='127.0.0.1', help="监听地址，默认127.0.0.1")
+    parser.add_argument('--port', type=int, default=8765, help="端口，默认8765")
+    parser.add_argument('--settings', default='settings.json', help="默认设置文件，请求中的设置会覆盖其中的项")
+    parser.add_argument('--fonts', default='fonts', help="字体文件夹，默认fonts")
+    parser.add_argument('--backgrounds', default='background', help="背景文件夹，默认background")
+    parser.add_argument('--workers', type=int, default=2, help="渲染线程数，默认2")
+    parser.add_argument('--queue', type=int, default=8, help="最多排队的请求数，超过时返回503，默认8")
+    parser.add_argument('--timeout', type=float, default=60, help="单个请求的超时时间（秒），默认60")
+    args = parser.parse_args(argv)
+
+    service = RenderService(load_settings(args.settings), args.fonts, args.backgrounds, args.workers, args.queue,
+                            args.timeout)
+    service.warm()
+    server = create_server(service, args.host, args.port)
+    print(f"渲染服务已启动：http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,93 @@
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import queue
+import threading
+
+
+class RenderCancelled(Exception):
+    """渲染任务已被取消"""
+
+
+class RenderJob:
+    """一个后台渲染任务"""
+
+    def __init__(self, job_id, kind):
+        self.job_id = job_id
+        self.kind = kind
+        self.future = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        """取消任务，未开始的任务不再执行，正在执行的任务在下一个检查点停止"""
+        self.cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise RenderCancelled()
+
+
+class RenderWorker:
+    """在后台线程中执行渲染任务，进度和结果通过队列交给界面线程处理"""
+
+    def __init__(self, max_workers=1):
+        # 默认只用一个线程，任务按提交顺序执行，渲染器不需要加锁
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='render')
+        self.messages = queue.Queue()
+        self.jobs = {}
+        self._job_ids = itertools.count(1)
+
+    def submit(self, kind, func, *args):
+        """提交任务，func的参数为(job, progress, *args)，progress(0-100)用于报告进度"""
+        job = RenderJob(next(self._job_ids), kind)
+
+        def progress(value):
+            self.messages.put(('progress', job, value))
+
+        def run():
+            try:
+                job.check_cancelled()
+                result = func(job, progress, *args)
+                self.messages.put(('done', job, result))
+            except RenderCancelled:
+                self.messages.put(('cancelled', job, None))
+            except Exception as e:
+                self.messages.put(('error', job, e))
+
+        self.jobs[job.job_id] = job
+        job.future = self.executor.submit(run)
+        return job
+
+    def cancel(self, kind=None):
+        """取消指定类型（默认全部）的任务"""
+        for job in list(self.jobs.values()):
+            if kind is None or job.kind == kind:
+                job.cancel()
+
+    def poll(self):
+        """取出目前为止的所有消息[(事件, 任务, 数据), ...]，应在界面线程中定时调用"""
+        messages = []
+        while True:
+            try:
+                event, job, data = self.messages.get_nowait()
+            except queue.Empty:
+                break
+            if event != 'progress':
+                self.jobs.pop(job.job_id, None)
+            elif job.cancelled:
+                continue
+            messages.append((event, job, data))
+        # 清理未开始就被取消的任务
+        for job_id, job in list(self.jobs.items()):
+            if job.future.cancelled():
+                del self.jobs[job_id]
+        return messages
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,152 @@
+import json
+import os
+import threading
+import time
+
+# get_changes()中表示该项已被删除
+REMOVED = object()
+
+
+def get_changes(old, new):
+    """new相对于old修改过的项，嵌套的字典逐项比较，删除的项为REMOVED"""
+    changes = {}
+    for key, value in new.items():
+        if isinstance(value, dict) and isinstance(old.get(key), dict):
+            nested = get_changes(old[key], value)
+            if nested:
+                changes[key] = nested
+        elif key not in old or old[key] != value:
+            changes[key] = value
+    for key in old:
+        if key not in new:
+            changes[key] = REMOVED
+    return changes
+
+
+def apply_changes(settings, changes):
+    """返回在settings上应用get_changes()结果后的新设置"""
+    result = dict(settings)
+    for key, value in changes.items():
+        if value is REMOVED:
+            result.pop(key, None)
+        elif isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = apply_changes(result[key], value)
+        else:
+            result[key] = value
+    return result
+
+
+class SettingsStore:
+    """
+    settings.json的读写：修改先保存在内存中，停止修改一段时间后在后台线程中写入，
+    写入时先写临时文件再改名，不会留下写了一半的文件。还可以检测文件是否被其他程序修改
+    """
+
+    def __init__(self, path='settings.json', delay=1.0):
+        self.path = path
+        # 最后一次修改后等待的秒数
+        self.delay = delay
+        self.pending = None
+        self.deadline = None
+        # 最后一次读取或写入后文件的(修改时间, 大小)，用于判断文件是否被外部修改
+        self.signature = None
+        # 最后一次读取或写入的设置，与pending比较得到尚未保存的修改
+        self.saved = None
+        self.closed = False
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = threading.Thread(target=self.run, name='settings-store', daemon=True)
+        self._thread.start()
+
+    def get_signature(self):
+        try:
+            stat = os.stat(self.path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def load(self):
+        """读取设置文件，文件不存在或无法解析时返回None"""
+        if not os.path.exists(self.path):
+            return None
+        with self._write_lock:
+            signature = self.get_signature()
+            with open(self.path, 'r', encoding='utf-8') as f:
+                settings = json.load(f)
+            self.signature = signature
+            self.saved = settings
+        return settings
+
+    def save(self, settings):
+        """记录新的设置，停止修改delay秒后才写入文件"""
+        with self._condition:
+            self.pending = settings
+            self.deadline = time.monotonic() + self.delay
+            self._condition.notify()
+
+    def run(self):
+        """后台线程：等到没有新的修改后写入文件"""
+        while True:
+            with self._condition:
+                while not self.closed and (self.pending is None or time.monotonic() < self.deadline):
+                    timeout = None if self.pending is None else max(0, self.deadline - time.monotonic())
+                    self._condition.wait(timeout)
+                if self.closed:
+                    return
+            self.flush()
+
+    def flush(self):
+        """立即写入尚未保存的设置"""
+        with self._condition:
+            settings = self.pending
+            self.pending = None
+        if settings is None:
+            return
+        temp_path = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            with self._write_lock:
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(settings, f, ensure_ascii=False, indent=4)
+                os.replace(temp_path, self.path)
+                self.signature = self.get_signature()
+                self.saved = settings
+        except Exception as e:
+            print(f"保存设置失败: {str(e)}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def check_external_change(self):
+        """
+        文件被其他程序修改过时返回新的设置，否则返回None。
+        还有未保存的修改时，把这些修改合并到外部修改后的设置上，合并结果稍后写入文件
+        """
+        signature = self.get_signature()
+        if signature is None or signature == self.signature:
+            return None
+        with self._write_lock:
+            # 正在写入的是自己的修改
+            if self.get_signature() == self.signature:
+                return None
+        saved = self.saved
+        try:
+            settings = self.load()
+        except Exception as e:
+            # 可能正在被其他程序写入，下次再检查
+            print(f"加载设置失败: {str(e)}")
+            return None
+        with self._condition:
+            if self.pending is not None:
+                # 只保留上次读取或写入之后修改过的项，其余使用外部修改后的值
+                changes = get_changes(saved or {}, self.pending)
+                settings = self.pending = apply_changes(settings, changes)
+        return settings
+
+    def close(self):
+        """写入尚未保存的设置并停止后台线程"""
+        with self._condition:
+            self.closed = True
+            self._condition.notify()
+        self._thread.join()
+        self.flush()
@@ -0,0 +1,87 @@
+"""
+长文档流式转换：逐块读取文本文件或标准输入，每排满一页就渲染并保存，
+内存占用与文档长度无关，适合整本书或很长的报告
+
+用法：
+    python stream_convert.py book.txt --output Output/book
+    type report.txt | python stream_convert.py - --name report
+"""
+from handwriting_renderer import HandwritingRenderer, load_settings
+from output_encoders import get_encoder, write_pages
+import argparse
+import io
+import itertools
+import os
+import sys
+import time
+
+# 每次读取的字符数
+CHUNK_SIZE = 64 * 1024
+
+
+def read_chunks(f, chunk_size=CHUNK_SIZE):
+    """逐块读取文本"""
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def stream_convert(renderer, chunks, encoder, output_dir='Output', name='handwriting'):
+    """流式转换，每保存一页返回(页码, 文件名, 写入的字节数, 耗时)"""
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    prefix = os.path.join(output_dir, name)
+    # 页数事先未知，每页都加页码（PDF为同一个文件）
+    filenames = (encoder.get_filename(prefix, index) for index in itertools.count())
+    start = time.perf_counter()
+    pages = renderer.render_stream(chunks)
+    for index, filename, size in write_pages(encoder, pages, filenames, renderer.profiler):
+        yield index + 1, filename, size, time.perf_counter() - start
+        start = time.perf_counter()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="逐页流式转换长文档")
+    parser.add_argument('input', help="文本文件，-表示从标准输入读取")
+    parser.add_argument('--settings', default='settings.json', help="设置文件，默认settings.json")
+    parser.add_argument('--fonts', default='fonts', help="字体文件夹，默认fonts")
+    parser.add_argument('--output', default='Output', help="输出文件夹，默认Output")
+    parser.add_argument('--name', default=None, help="输出文件名前缀，默认为输入文件名")
+    parser.add_argument('--encoding', default='utf-8', help="文本编码，默认utf-8")
+    parser.add_argument('--format', choices=['png', 'jpeg', 'webp', 'pdf'], help="输出格式，默认使用设置中的output项")
+    args = parser.parse_args(argv)
+
+    if args.input == '-':
+        f = io.TextIOWrapper(sys.stdin.buffer, encoding=args.encoding)
+        name = args.name or 'handwriting'
+    else:
+        f = open(args.input, 'r', encoding=args.encoding)
+        name = args.name or os.path.splitext(os.path.basename(args.input))[0]
+
+    settings = load_settings(args.settings)
+    if args.format:
+        settings['output'] = dict(settings.get('output') or {}, format=args.format)
+    renderer = HandwritingRenderer(settings, fonts_dir=args.fonts)
+    encoder = get_encoder(settings)
+    total = 0
+    start = time.perf_counter()
+    try:
+        with f, renderer.profiler.record('stream'):
+            for page_number, filename, size, seconds in stream_convert(renderer, read_chunks(f), encoder,
+                                                                       args.output, name):
+                total = page_number
+                print(f"第{page_number}页已保存：{filename}，{size / 1024:.0f}KB，耗时{seconds:.2f}秒")
+    except Exception as e:
+        print(f"流式转换失败: {str(e)}")
+        return 1
+    elapsed = time.perf_counter() - start
+    stats = encoder.stats()
+    print(f"共{total}页，总耗时{elapsed:.2f}秒，其中编码{stats['encode_ms'] / 1000:.2f}秒，"
+          f"共写入{stats['encoded_bytes'] / 1024 / 1024:.2f}MB")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())